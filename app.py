@@ -11,70 +11,197 @@ import os
 from openpyxl.drawing.image import Image as XLImage
 
 
+app = Flask(__name__, static_folder="static", static_url_path="/static")
+app.secret_key = "report_app_secret_key"
+DB_NAME = "report.db"
 
-def get_departments():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT short_name, full_name FROM departments ORDER BY short_name"
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
-def get_db():
-    conn = sqlite3.connect("report.db")
+# ==================================================
+# DB connection (1 connection ต่อ request / เก็บไว้ที่ g)
+# ==================================================
+from flask import g
+import threading
+
+# ตั้งค่าครั้งเดียวตอนเปิด connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",       # ~16 MB
+    "PRAGMA mmap_size = 268435456",     # 256 MB
+    "PRAGMA temp_store = MEMORY",
+)
+
+def open_db():
+    conn = sqlite3.connect(DB_NAME, timeout=5)
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    ensure_schema(conn)
     return conn
-    
-def get_department_full(code):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT full_name FROM departments WHERE short_name = ?",
-        (code,)
-    )
-    row = cur.fetchone()
+
+
+def get_db():
+    """
+    คืน connection ของ request ปัจจุบัน
+    - 1 request ใช้ connection เดียว (เก็บไว้ที่ g) ปิดตอนจบ request (close_db)
+    - schema เช็กครั้งเดียวต่อ process (ensure_schema) → เปิดใหม่ทุก request ก็ไม่แพง
+    """
+    if "db" not in g:
+        g.db = open_db()
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db(exc):
+    conn = g.pop("db", None)
+    if conn is None:
+        return
+
+    # ✅ งานที่ค้างไม่ได้ commit → ยกเลิก แล้วปิด (ไม่ค้าง handle / WAL reader ไว้กับ thread)
+    if conn.in_transaction:
+        conn.rollback()
     conn.close()
-    return row[0] if row else code
 
 
-app = Flask(__name__, static_folder="static", static_url_path="/static")
-app.secret_key = "report_app_secret_key"
-DB_NAME = "report.db"
+from contextlib import contextmanager
+
+
+@contextmanager
+def write_tx(conn):
+    """
+    transaction สำหรับงานเขียน
+    BEGIN IMMEDIATE = จอง lock เขียนตั้งแต่ต้น อ่าน-แล้ว-เขียนจะไม่ชนกับ request อื่น
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def table_version(conn, table):
+    row = conn.execute(
+        "SELECT version FROM table_versions WHERE name = ?", (table,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+# COUNT(*) ที่เคยนับแล้ว ใช้ซ้ำจนกว่าข้อมูลในตารางจะเปลี่ยน
+_count_cache = {}
+_count_cache_lock = threading.Lock()    # ใช้ร่วมกันหลาย thread (request / งาน export)
+COUNT_CACHE_SIZE = 256
+
+
+def cached_count(conn, table, sql, params):
+    key = (sql, tuple(params))
+    version = table_version(conn, table)
+
+    with _count_cache_lock:
+        hit = _count_cache.get(key)
+    if hit and hit[0] == version:
+        return hit[1]
+
+    # นับนอก lock → query ช้าไม่ขวาง thread อื่น
+    total = conn.execute(sql, params).fetchone()[0]
+
+    with _count_cache_lock:
+        if len(_count_cache) >= COUNT_CACHE_SIZE:
+            _count_cache.pop(next(iter(_count_cache)), None)
+        _count_cache[key] = (version, total)
+    return total
 
 
 # ==================================================
-# สร้างเลขงาน
+# ทะเบียนหน่วยงาน (โหลดครั้งเดียว / โหลดใหม่เมื่อตาราง departments เปลี่ยน)
 # ==================================================
-def generate_work_no(created_at):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+# (version, [(short, full, active), ...], {short: full}, {full: short})
+_dept_registry = (None, [], {}, {})
 
-    dt = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
-    month = dt.strftime("%m")
-    year = dt.strftime("%y")
-    suffix = f"{month}{year}"
 
-    # ✅ หาเลขล่าสุดของเดือนนี้
-    cursor.execute("""
-        SELECT work_no
-        FROM reports
-        WHERE work_no LIKE ?
-        ORDER BY work_no DESC
-        LIMIT 1
-    """, (f"%{suffix}",))
+def _department_registry():
+    global _dept_registry
 
-    row = cursor.fetchone()
-    conn.close()
+    # 1 request เช็ก version ครั้งเดียวพอ
+    if "dept_registry" in g:
+        return g.dept_registry
 
-    if row:
-        last_seq = int(row[0][:3])
-        next_seq = last_seq + 1
-    else:
-        next_seq = 1
+    conn = get_db()
+    version = table_version(conn, "departments")
+    registry = _dept_registry
+
+    if registry[0] != version:
+        rows = [
+            (r["short_name"], r["full_name"], r["active"])
+            for r in conn.execute(
+                "SELECT short_name, full_name, active "
+                "FROM departments ORDER BY short_name"
+            )
+        ]
+        registry = (
+            version,
+            rows,
+            {short: full for short, full, _ in rows},
+            {full: short for short, full, _ in rows},
+        )
+        _dept_registry = registry
+
+    g.dept_registry = registry
+    return registry
+
+
+def get_departments():
+    return [(short, full) for short, full, _ in _department_registry()[1]]
+
+
+def department_map(active_only=False):
+    """dict ชื่อย่อ → ชื่อเต็ม"""
+    _, rows, by_short, _ = _department_registry()
+    if active_only:
+        return {short: full for short, full, active in rows if active}
+    return by_short
+
+
+def get_department_full(code):
+    return _department_registry()[2].get(code, code)
+
+
+def get_department_short(full_name):
+    return _department_registry()[3].get(full_name, full_name)
 
-    return f"{str(next_seq).zfill(3)}{suffix}"
+
+@app.context_processor
+def inject_departments():
+    # ให้ทุก template ใช้ {{ dept_map.get(code, code) }} ได้เลย
+    return {"dept_map": department_map()}
+
+
+# ==================================================
+# สร้างเลขงาน
+# ==================================================
+def generate_work_no(conn, created_at):
+    """
+    เลขงาน = ลำดับ (อย่างน้อย 3 หลัก) + MMYY เช่น 0010126
+    ⚠️ ต้องเรียกภายใน write_tx() เดียวกับ INSERT
+       เลขจะได้ไม่ซ้ำแม้บันทึกพร้อมกันหลายเครื่อง
+    """
+    dt = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
+    period = dt.strftime("%m%y")
+
+    conn.execute("""
+        INSERT INTO work_no_seq (period, last_seq)
+        VALUES (?, 1)
+        ON CONFLICT(period) DO UPDATE SET last_seq = last_seq + 1
+    """, (period,))
+
+    next_seq = conn.execute(
+        "SELECT last_seq FROM work_no_seq WHERE period = ?",
+        (period,)
+    ).fetchone()[0]
+
+    return f"{str(next_seq).zfill(3)}{period}"
 
 
 # ==================================================
@@ -123,14 +250,306 @@ def format_month_th(year, month):
     return f"{months[month-1]} {year + 543}"
 
 
+# ==================================================
+# ช่วงเวลา สำหรับ query บน receive_at (ใช้ index ได้)
+# ==================================================
+from datetime import timedelta
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def day_range(date_from, date_to):
+    """
+    'YYYY-MM-DD' ถึง 'YYYY-MM-DD' (รวมวันสุดท้าย)
+    → (start, end) ใช้กับ receive_at >= ? AND receive_at < ?
+    วันที่ผิดรูปแบบ → เดือนปัจจุบัน (เหมือนไม่ได้เลือกช่วงวันที่)
+    """
+    try:
+        start = datetime.strptime(date_from[:10], "%Y-%m-%d")
+        end = datetime.strptime(date_to[:10], "%Y-%m-%d") + timedelta(days=1)
+    except ValueError:
+        now = datetime.now(ZoneInfo("Asia/Bangkok"))
+        return month_range(now.year, now.month)
+    return start.strftime(TS_FORMAT), end.strftime(TS_FORMAT)
+
+
+def month_range(year, month):
+    start = datetime(year, month, 1)
+    if month == 12:
+        end = datetime(year + 1, 1, 1)
+    else:
+        end = datetime(year, month + 1, 1)
+    return start.strftime(TS_FORMAT), end.strftime(TS_FORMAT)
+
+
+def whole_months(date_from, date_to):
+    """
+    ช่วงวันที่ตรงต้นเดือน-สิ้นเดือนพอดี → ((ปี, เดือน) แรก, (ปี, เดือน) สุดท้าย)
+    ไม่ตรง → None
+    """
+    try:
+        start = datetime.strptime(date_from[:10], "%Y-%m-%d")
+        end = datetime.strptime(date_to[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+
+    if start.day != 1 or (end + timedelta(days=1)).day != 1 or start > end:
+        return None
+    return (start.year, start.month), (end.year, end.month)
+
+
 
 # ==================================================
-# DB
+# DB (migration ตาม PRAGMA user_version)
 # ==================================================
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
+def _migrate_work_no(conn):
+    # DB รุ่นแรกไม่มีคอลัมน์ work_no (เดิมทำใน scripts/upgrade_db.py)
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(reports)")]
+    if "work_no" not in cols:
+        conn.execute("ALTER TABLE reports ADD COLUMN work_no TEXT")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_work_no ON reports(work_no)"
+    )
+
+
+REPORTS_FTS_COLUMNS = (
+    "work_no", "department", "reporter", "job_type",
+    "asset_no", "problem", "solution",
+)
+
+
+def _create_reports_fts(conn):
+    """
+    ตารางค้นหาเงาของ reports (external content) + trigger ให้ตรงกันเสมอ
+    trigram ตัดคำทีละ 3 ตัวอักษร → ภาษาไทยที่ไม่มีเว้นวรรคก็ค้นเจอ
+    """
+    cols = ", ".join(REPORTS_FTS_COLUMNS)
+    new_cols = ", ".join(f"new.{c}" for c in REPORTS_FTS_COLUMNS)
+    old_cols = ", ".join(f"old.{c}" for c in REPORTS_FTS_COLUMNS)
+
+    try:
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+                {cols},
+                content='reports',
+                content_rowid='id',
+                tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        # SQLite รุ่นเก่า (ไม่มี FTS5 / trigram) → /list กลับไปใช้ LIKE แบบเดิม
+        print("⚠️ ข้าม FTS5:", e)
+        return
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS reports_fts_ai AFTER INSERT ON reports BEGIN
+            INSERT INTO reports_fts (rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS reports_fts_ad AFTER DELETE ON reports BEGIN
+            INSERT INTO reports_fts (reports_fts, rowid, {cols})
+            VALUES ('delete', old.id, {old_cols});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS reports_fts_au AFTER UPDATE OF {cols} ON reports BEGIN
+            INSERT INTO reports_fts (reports_fts, rowid, {cols})
+            VALUES ('delete', old.id, {old_cols});
+            INSERT INTO reports_fts (rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    """)
+    conn.execute("INSERT INTO reports_fts (reports_fts) VALUES ('rebuild')")
+
+
+def _version_triggers(table):
+    # เขียนตารางเมื่อไหร่ version +1 → cache ที่จำ version เก่ารู้ทันทีว่าหมดอายุ
+    bump = (
+        "UPDATE table_versions SET version = version + 1 "
+        f"WHERE name = '{table}';"
+    )
+    return [
+        f"INSERT OR IGNORE INTO table_versions (name) VALUES ('{table}')",
+        *(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_version_{op[0].lower()} "
+            f"AFTER {op} ON {table} BEGIN {bump} END"
+            for op in ("INSERT", "UPDATE", "DELETE")
+        ),
+    ]
+
+
+# คีย์ของตารางสรุป (NULL เก็บเป็น '' เพื่อให้ ON CONFLICT จับคู่ได้)
+def _rollup_key(row):
+    return f"""
+        CAST(substr({row}.receive_at, 1, 4) AS INTEGER),
+        CAST(substr({row}.receive_at, 6, 2) AS INTEGER),
+        COALESCE({row}.department, ''),
+        COALESCE({row}.job_type, ''),
+        COALESCE({row}.confirm_name, '')
+    """
+
+
+def _create_report_rollup(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS report_monthly_rollup (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            department TEXT NOT NULL,
+            job_type TEXT NOT NULL,
+            confirm_name TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (year, month, department, job_type, confirm_name)
+        ) WITHOUT ROWID
+    """)
+
+    add_new = f"""
+        INSERT INTO report_monthly_rollup
+            (year, month, department, job_type, confirm_name, total)
+        SELECT {_rollup_key("new")}, 1
+        WHERE new.receive_at IS NOT NULL
+        ON CONFLICT (year, month, department, job_type, confirm_name)
+        DO UPDATE SET total = total + 1;
+    """
+    remove_old = f"""
+        UPDATE report_monthly_rollup
+        SET total = total - 1
+        WHERE old.receive_at IS NOT NULL
+          AND (year, month, department, job_type, confirm_name)
+              = ({_rollup_key("old")});
+        DELETE FROM report_monthly_rollup
+        WHERE old.receive_at IS NOT NULL
+          AND (year, month, department, job_type, confirm_name)
+              = ({_rollup_key("old")})
+          AND total <= 0;
+    """
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS report_rollup_ai AFTER INSERT ON reports
+        BEGIN {add_new} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS report_rollup_ad AFTER DELETE ON reports
+        BEGIN {remove_old} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS report_rollup_au
+        AFTER UPDATE OF receive_datetime, department, job_type, confirm_name
+        ON reports
+        BEGIN {remove_old} {add_new} END
+    """)
+
+    rebuild_report_rollup(conn)
+
+
+def rebuild_report_rollup(conn):
+    """
+    คำนวณตารางสรุปใหม่ทั้งหมดจาก reports
+    ใช้หลังนำเข้าข้อมูลย้อนหลัง / แก้ข้อมูลตรง ๆ ใน DB (scripts/rebuild_rollup.py)
+    """
+    conn.execute("DELETE FROM report_monthly_rollup")
+    conn.execute(f"""
+        INSERT INTO report_monthly_rollup
+            (year, month, department, job_type, confirm_name, total)
+        SELECT {_rollup_key("reports")}, COUNT(*)
+        FROM reports
+        WHERE receive_at IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+
+
+def _create_month_snapshots(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS closed_months (
+            period TEXT PRIMARY KEY,            -- YYYY-MM
+            closed_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS month_snapshots (
+            period TEXT NOT NULL,
+            kind TEXT NOT NULL,                 -- summary / report / monthly / attendance
+            name TEXT NOT NULL DEFAULT '',      -- attendance = ชื่อเจ้าหน้าที่
+            etag TEXT NOT NULL,                 -- hash ของ content
+            filename TEXT,
+            mimetype TEXT NOT NULL,
+            content BLOB NOT NULL,
+            PRIMARY KEY (period, kind, name)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_month_snapshots_etag "
+        "ON month_snapshots(etag)"
+    )
+
+    # เปิดเดือน (ลบแถว closed_months) → snapshot ของเดือนนั้นหายไปด้วย
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS closed_months_ad AFTER DELETE ON closed_months
+        BEGIN
+            DELETE FROM month_snapshots WHERE period = old.period;
+        END
+    """)
+
+    # แก้ข้อมูลของเดือนที่ปิดแล้ว → เปิดเดือนให้อัตโนมัติ
+    for table, column in (("reports", "receive_at"), ("attendance", "work_date")):
+        new = f"substr(new.{column}, 1, 7)"
+        old = f"substr(old.{column}, 1, 7)"
+        for op, periods in (
+            ("INSERT", new),
+            ("UPDATE", f"{old}, {new}"),    # ย้ายเดือน → เปิดทั้งเดือนเดิมและเดือนใหม่
+            ("DELETE", old),
+        ):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_reopen_{op[0].lower()}
+                AFTER {op} ON {table}
+                BEGIN
+                    DELETE FROM closed_months WHERE period IN ({periods});
+                END
+            """)
+
+
+def _canonicalize_asset_nos(conn):
+    """
+    เลขครุภัณฑ์เดิมในตาราง → รูปแบบเดียวกับตอนนำเข้า (canonical_asset_no)
+    ไม่งั้นนำเข้าไฟล์เดิมซ้ำจะ join ไม่เจอ (เช่นเลขที่มี \n ติดท้าย) แล้วได้แถวซ้ำ
+    หลายแถวกลายเป็นเลขเดียวกัน → แถวที่เลขถูกอยู่แล้ว (หรือ id น้อยสุด) ได้เลขนั้น
+    แถวที่เหลือคงเลขเดิมไว้ + เขียนหมายเหตุให้ตรวจ (ไม่ลบข้อมูลเอง)
+    """
+    groups = defaultdict(list)
+    for asset_id, asset_no in conn.execute("SELECT id, asset_no FROM assets ORDER BY id"):
+        canonical = canonical_asset_no(asset_no or "")
+        if canonical:
+            groups[canonical].append((asset_id, asset_no))
+
+    for canonical, rows in groups.items():
+        keep = next((r for r in rows if r[1] == canonical), rows[0])
+        if keep[1] != canonical:
+            conn.execute(
+                "UPDATE assets SET asset_no = ? WHERE id = ?", (canonical, keep[0])
+            )
+        for asset_id, _ in rows:
+            if asset_id == keep[0]:
+                continue
+            conn.execute("""
+                UPDATE assets
+                SET note = COALESCE(NULLIF(note, '') || ' / ', '') || ?
+                WHERE id = ?
+            """, (f"เลขครุภัณฑ์ซ้ำกับรายการ #{keep[0]} ({canonical}) กรุณาตรวจสอบ", asset_id))
+
+
+def _seed_departments(conn):
+    count = conn.execute("SELECT COUNT(*) FROM departments").fetchone()[0]
+    if count == 0:
+        conn.executemany(
+            "INSERT INTO departments (short_name, full_name) VALUES (?, ?)",
+            DEPT_FULLNAME.items()
+        )
+
+
+# (เวอร์ชัน, คำอธิบาย, [SQL ...] หรือ function(conn))
+# ⚠️ เพิ่มต่อท้ายเท่านั้น ห้ามแก้ของเก่าที่รันไปแล้ว
+MIGRATIONS = [
+    (1, "ตารางหลัก", [
+        """
         CREATE TABLE IF NOT EXISTS reports (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             work_no TEXT UNIQUE,
@@ -147,9 +566,8 @@ def init_db():
             signature TEXT,
             created_at TEXT
         )
-    """)
-    
-    cursor.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS attendance (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             staff_name TEXT NOT NULL,
@@ -158,15 +576,8 @@ def init_db():
             time_out TEXT,
             note TEXT
         )
-    """)
-    conn.commit()
-    conn.close()
-
-
-def init_assets_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
+        """,
+        """
         CREATE TABLE IF NOT EXISTS assets (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             asset_no TEXT UNIQUE NOT NULL,
@@ -181,54 +592,151 @@ def init_assets_db():
             status TEXT DEFAULT 'ใช้งาน',
             note TEXT
         )
-    """)
-    conn.commit()
-    conn.close()
-
-
-
-# ==================================================
-# FIX ข้อมูลลายเซ็นที่เคยสลับช่อง
-# ==================================================
-def fix_signature_column():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS departments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            short_name TEXT NOT NULL,
+            full_name TEXT NOT NULL,
+            active INTEGER DEFAULT 1
+        )
+        """,
+    ]),
+    (2, "คอลัมน์เลขงาน + unique index", _migrate_work_no),
+    (3, "index สำหรับ query ที่ใช้บ่อย", [
+        "CREATE INDEX IF NOT EXISTS idx_reports_receive "
+        "ON reports(receive_datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_confirm_receive "
+        "ON reports(confirm_name, receive_datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_dept_type_receive "
+        "ON reports(department, job_type, receive_datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_assets_dept_status_type "
+        "ON assets(department, status, asset_type)",
+        "CREATE INDEX IF NOT EXISTS idx_attendance_staff_date "
+        "ON attendance(staff_name, work_date)",
+    ]),
+    (4, "หน่วยงานเริ่มต้น", _seed_departments),
+    (5, "แก้ลายเซ็นที่เคยสลับช่อง (ครั้งเดียว)", [
         """
         UPDATE reports
         SET signature = confirm_name,
             confirm_name = ''
         WHERE confirm_name LIKE '%.png'
           AND (signature IS NULL OR signature = '')
+        """,
+    ]),
+    (6, "วันเวลามาตรฐาน receive_at / completed_at", [
+        # เก็บจริงเป็น 'HH:MM' ปน 'HH:MM:SS' → datetime() ให้รูปแบบเดียวกัน
+        "ALTER TABLE reports ADD COLUMN receive_at TEXT "
+        "GENERATED ALWAYS AS (datetime(receive_datetime)) VIRTUAL",
+        "ALTER TABLE reports ADD COLUMN completed_at TEXT "
+        "GENERATED ALWAYS AS (datetime(completed_datetime)) VIRTUAL",
+        "DROP INDEX IF EXISTS idx_reports_receive",
+        "DROP INDEX IF EXISTS idx_reports_confirm_receive",
+        "DROP INDEX IF EXISTS idx_reports_dept_type_receive",
+        "CREATE INDEX IF NOT EXISTS idx_reports_receive_at "
+        "ON reports(receive_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_completed_at "
+        "ON reports(completed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_confirm_receive_at "
+        "ON reports(confirm_name, receive_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_dept_type_receive_at "
+        "ON reports(department, job_type, receive_at)",
+    ]),
+    (7, "ตัวนับเลขงานรายเดือน", [
+        """
+        CREATE TABLE IF NOT EXISTS work_no_seq (
+            period TEXT PRIMARY KEY,            -- MMYY
+            last_seq INTEGER NOT NULL
+        )
+        """,
+        # ต่อจากเลขล่าสุดที่มีอยู่แล้ว (ลำดับ = ทุกหลักยกเว้น 4 ตัวท้าย)
+        """
+        INSERT OR REPLACE INTO work_no_seq (period, last_seq)
+        SELECT
+            substr(work_no, -4),
+            MAX(CAST(substr(work_no, 1, length(work_no) - 4) AS INTEGER))
+        FROM reports
+        WHERE length(work_no) >= 7
+        GROUP BY substr(work_no, -4)
+        """,
+    ]),
+    (8, "ดัชนีค้นหา FTS5 (trigram) ของงาน", _create_reports_fts),
+    (9, "เลขเวอร์ชันข้อมูลต่อตาราง (ใช้ล้าง cache)", [
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        *_version_triggers("reports"),
+    ]),
+    (10, "เวอร์ชันข้อมูลหน่วยงาน", _version_triggers("departments")),
+    (11, "ตารางสรุปรายเดือน (หน่วยงาน × ประเภทงาน × ผู้ปิดงาน)", _create_report_rollup),
+    (12, "เวอร์ชันข้อมูลครุภัณฑ์ / ลงเวลา", [
+        *_version_triggers("assets"),
+        *_version_triggers("attendance"),
+    ]),
+    (13, "ปิดเดือน + ไฟล์ snapshot ของเดือนที่ปิดแล้ว", _create_month_snapshots),
+    (14, "จัดรูปแบบเลขครุภัณฑ์เดิมให้ตรงกับตอนนำเข้า", _canonicalize_asset_nos),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def migrate_db(conn):
     """
-    )
-    conn.commit()
-    conn.close()
+    รัน migration ที่ยังไม่ได้รัน ใน transaction เดียว
+    - schema ล่าสุดแล้ว → อ่าน PRAGMA user_version ครั้งเดียวแล้วจบ
+    - พังกลางทาง → rollback ทั้งชุด user_version ไม่ขยับ
+    คืนค่า (เวอร์ชันก่อน, เวอร์ชันหลัง)
+    """
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    if current >= SCHEMA_VERSION:
+        return current, current
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # อ่านซ้ำหลังได้ lock กันอีก process รันไปก่อนแล้ว
+        before = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for version, _desc, step in MIGRATIONS:
+            if version <= before:
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                for sql in step:
+                    conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {version}")
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return before, SCHEMA_VERSION
+
+
+def ensure_schema(conn):
+    # เช็กครั้งเดียวต่อ process
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            migrate_db(conn)
+            _schema_ready = True
+
 
-DEPT_MAP = {
-        "กลุ่มกฏหมาย":"กกม.",
-        "กลุ่มพัฒนาระบบบริหาร":"กพร.",
-        "กองส่งเสริมสิทธิและเสรีภาพ":"กสส.",
-        "กองยุทธศาสตร์และแผนสิทธิมนุษยชนแห่งชาติ":"กยผ.",
-        "สำนักงานป้องกันและปราบปรามการทรมานและการกระทำให้บุคคลสูญหาย":"สปท.",
-        "กลุ่มตรวจสอบภายใน":"กตน.",
-        "กองสิทธิมนุษยชนระหว่างประเทศ":"กสป.",
-        "สำนักงานช่วยเหลือทางการเงินแก่ผู้เสียหายและจำเลยในคดีอาญา":"สชง.",
-        "กองส่งเสริมการระงับข้อพิพาท":"กสร.",
-        "กองพิทักษ์สิทธิและเสรีภาพ":"กพส.",
-        "สำนักงานคุ้มครองพยาน":"สคพ.",
-        "กลุ่มผู้เชี่ยวชาญ":"กชช.",
-        "ศูนย์ข้อมูลและพัฒนาระบบเทคโนโลยีสารสนเทศ":"ศพท.",
-        "กลุ่มงานคลัง":"กงค.",
-        "กลุ่มงานบริหารและพัฒนาทรัพยากรบุคคล":"กบค.",
-        "กลุ่มงานช่วยอำนวยการและสื่อสารองค์กร":"กชอ.",
-        "กลุ่มงานบริหารพัสดุ":"กบพ.",
-        "ห้องประชุม": "ห้องประชุม",
-        "ห้องอธิบดี": "ห้องอธิบดี",
-        "ห้องรองอธิบดี": "ห้องรองอธิบดี",
-}
 from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
 from flask import flash, url_for
+from zipfile import BadZipFile
+import itertools
 
 
 # ==================================================
@@ -262,91 +770,605 @@ def export_db():
 def assets_import_page():
     return render_template("assets_import.html")
 
-@app.route("/assets/import", methods=["POST"])
-def assets_import():
-    import pandas as pd
+# คอลัมน์ในตาราง assets ← หัวคอลัมน์ในไฟล์ (แถวที่ 2)
+ASSET_IMPORT_COLUMNS = [
+    ("asset_no", "เลขครุภัณฑ์"),
+    ("asset_type", "ประเภทเครื่อง"),
+    ("asset_model", "ยี่ห้อ/รุ่น"),
+    ("serial_no", "Serial Number"),
+    ("mac_address", "Mac Address"),
+    ("hostname", "ชื่อเครื่อง"),
+    ("owner_name", "ผู้ครอบครอง"),
+    ("position", "ตำแหน่ง"),
+]
+IMPORT_BATCH = 1000
 
-    file = request.files.get("file")
-    if not file:
-        return "ไม่พบไฟล์", 400
 
-    # ✅ อ่านชื่อหน่วยงานจากแถวที่ 1 (A1)
-    meta_df = pd.read_excel(file, header=None)
-    dept_full = str(meta_df.iloc[0, 0]).strip()
-    dept_short = DEPT_MAP.get(dept_full, dept_full)
+class ImportFileError(Exception):
+    """ไฟล์นำเข้าไม่ถูกรูปแบบ (ตอบกลับ 400)"""
 
-    # ✅ อ่านข้อมูลจริง (หัวคอลัมน์อยู่แถวที่ 2)
-    df = pd.read_excel(file, header=1)
-    df = df.fillna("")   # 👈 บรรทัดนี้แหละ แก้ nan ทั้งหมด
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def import_cell_text(value):
+    # ช่องว่าง → "" / ตัวเลขจำนวนเต็มที่ Excel เก็บเป็น float (123.0) → "123"
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def read_asset_sheet(file):
+    """
+    อ่านไฟล์นำเข้าครุภัณฑ์รอบเดียว (openpyxl read-only ไม่โหลดทั้งชีตเข้าหน่วยความจำ)
+    แถว 1 = ชื่อหน่วยงาน (A1) / แถว 2 = หัวตาราง / แถว 3 เป็นต้นไป = ข้อมูล
+    คืน (ชื่อหน่วยงานเต็ม, generator ของ (เลขแถวใน Excel, ค่าเรียงตาม ASSET_IMPORT_COLUMNS))
+    แถวว่างทั้งแถว → ข้าม
+    """
+    try:
+        wb = load_workbook(file, read_only=True, data_only=True)
+    except (InvalidFileException, BadZipFile):
+        raise ImportFileError("ไฟล์ต้องเป็น Excel (.xlsx) เท่านั้น")
+    rows = wb.active.iter_rows(values_only=True)
+
+    first = next(rows, None)
+    header = next(rows, None)
+    if not first or not header:
+        wb.close()
+        raise ImportFileError("ไฟล์ไม่มีชื่อหน่วยงาน (แถวที่ 1) หรือหัวตาราง (แถวที่ 2)")
+
+    dept_full = import_cell_text(first[0])
+    index = {import_cell_text(h): i for i, h in enumerate(header)}
+    missing = [label for _, label in ASSET_IMPORT_COLUMNS if label not in index]
+    if missing:
+        wb.close()
+        raise ImportFileError("ไม่พบคอลัมน์: " + ", ".join(missing))
+
+    picks = [index[label] for _, label in ASSET_IMPORT_COLUMNS]
+
+    def records():
+        try:
+            for row_no, row in enumerate(rows, start=3):
+                # read-only ตัดช่องว่างท้ายแถวทิ้ง → แถวอาจสั้นกว่าหัวตาราง
+                values = [
+                    import_cell_text(row[i]) if i < len(row) else ""
+                    for i in picks
+                ]
+                if any(values):
+                    yield row_no, values
+        finally:
+            wb.close()
+
+    return dept_full, records()
+
+
+# ===== ตรวจ + จัดรูปแบบก่อนเขียน (ทีละคอลัมน์ทั้งไฟล์) =====
+from collections import defaultdict
+import re
+import unicodedata
+
+IMPORT_BLANKS = {"nan", "none", "null", "-", "n/a", "#n/a"}
+THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+DASHES = str.maketrans({c: "-" for c in "‐‑‒–—−"})
+MAC_SPLIT = re.compile(r"[,;/\n]+")
+MAC_SEPARATORS = re.compile(r"[\s:.\-]+")
+MAC_HEX = re.compile(r"[0-9A-F]{12}")
+WHITESPACE = re.compile(r"\s+")
+
+
+def canonical_asset_no(value):
+    # ตัวเลขไทย / เต็มความกว้าง → 0-9, ขีดแบบต่าง ๆ → "-", ตัดช่องว่าง, อังกฤษตัวใหญ่
+    value = unicodedata.normalize("NFKC", value).translate(THAI_DIGITS).translate(DASHES)
+    return WHITESPACE.sub("", value).upper()
+
+
+def normalize_mac(value):
+    """
+    MAC ทุกรูปแบบ (aa:bb.., aabb.cc.., AABBCC...) → AA-BB-CC-DD-EE-FF (แบบที่มีอยู่ในระบบ)
+    หลายค่าในช่องเดียว (คั่นด้วย , ; / ขึ้นบรรทัด) → คั่นด้วย ", "
+    คืน (ค่าที่จัดแล้ว, ถูกต้องไหม)
+    """
+    if not value:
+        return "", True
+
+    macs = []
+    for part in MAC_SPLIT.split(value):
+        # พิมพ์ O แทนเลขศูนย์บ่อย
+        digits = MAC_SEPARATORS.sub("", part).upper().replace("O", "0")
+        if not digits:
+            continue
+        if not MAC_HEX.fullmatch(digits):
+            return value, False
+        macs.append("-".join(digits[i:i + 2] for i in range(0, 12, 2)))
+    return ", ".join(macs), True
+
+
+def validate_asset_rows(records):
+    """
+    ตรวจ + จัดรูปแบบทั้งไฟล์ก่อนเขียนลงฐานข้อมูล (ทำทีละคอลัมน์ ไม่ใช่ try/except ทีละแถว)
+    records = [(เลขแถวใน Excel, ค่าเรียงตาม ASSET_IMPORT_COLUMNS)]
+    คืน (แถวที่จัดรูปแบบแล้ว, [(เลขแถว, เลขครุภัณฑ์, ปัญหา)])
+    ไฟล์ที่มีปัญหาแม้แถวเดียว → ผู้เรียกไม่ควรบันทึกไฟล์นั้น
+    """
+    records = list(records)
+    if not records:
+        return [], []
+
+    row_nos = [n for n, _ in records]
+    keys = [c for c, _ in ASSET_IMPORT_COLUMNS]
+    cols = dict(zip(keys, map(list, zip(*(values for _, values in records)))))
+
+    # ===== จัดรูปแบบ =====
+    for key, col in cols.items():
+        cols[key] = ["" if v.lower() in IMPORT_BLANKS else v for v in col]
+
+    raw_macs = cols["mac_address"]
+    macs = [normalize_mac(v) for v in raw_macs]
+    types = {t.lower(): t for t in ASSET_TYPES}
+
+    cols["asset_no"] = [canonical_asset_no(v) for v in cols["asset_no"]]
+    # ประเภทที่รู้จัก → สะกดแบบเดียวกัน / ประเภทอื่น (หรือว่าง) รับตามไฟล์ (หน้าสรุปแยกคอลัมน์ให้เอง)
+    cols["asset_type"] = [types.get(v.lower(), v) for v in cols["asset_type"]]
+    cols["serial_no"] = [v.upper() for v in cols["serial_no"]]
+    cols["mac_address"] = [m for m, _ in macs]
+
+    # ===== ตรวจ =====
+    errors = defaultdict(list)
+    first_seen = {}
+
+    for i, asset_no in enumerate(cols["asset_no"]):
+        if not asset_no:
+            errors[i].append("ไม่มีเลขครุภัณฑ์")
+        elif asset_no in first_seen:
+            errors[i].append(f"เลขครุภัณฑ์ซ้ำกับแถวที่ {row_nos[first_seen[asset_no]]}")
+        else:
+            first_seen[asset_no] = i
+
+    for i, (_, ok) in enumerate(macs):
+        if not ok:
+            errors[i].append(f"Mac Address ไม่ถูกต้อง: {raw_macs[i]}")
+
+    rows = [list(r) for r in zip(*cols.values())]
+    report = [
+        (row_nos[i], cols["asset_no"][i] or "-", " / ".join(messages))
+        for i, messages in sorted(errors.items())
+    ]
+    return rows, report
+
+
+def insert_assets(conn, department, records):
+    """
+    เพิ่มครุภัณฑ์ทีละ IMPORT_BATCH แถว (executemany) ใน transaction เดียว
+    เลขครุภัณฑ์ซ้ำ → ข้าม / คืนจำนวนที่เพิ่มได้จริง
+    """
+    columns = [c for c, _ in ASSET_IMPORT_COLUMNS] + ["department", "status"]
+    sql = f"""
+        INSERT OR IGNORE INTO assets ({", ".join(columns)})
+        VALUES ({", ".join("?" * len(columns))})
+    """
 
     count = 0
+    records = iter(records)
+    with write_tx(conn):
+        while True:
+            batch = [
+                (*r, department, "ใช้งาน")
+                for r in itertools.islice(records, IMPORT_BATCH)
+            ]
+            if not batch:
+                break
+            # rowcount ของ executemany = จำนวนแถวที่เพิ่มจริง (แถวซ้ำไม่นับ)
+            count += conn.executemany(sql, batch).rowcount
+    return count
+
+
+# ==================================================
+# นำเข้าหลายไฟล์ (ZIP / เลือกหลายไฟล์): อ่านขนานใน process pool
+# ==================================================
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from zipfile import ZipFile
+import io
+
+IMPORT_MAX_BYTES = 200 * 1024 * 1024     # ขนาดรวมหลังแตก ZIP
+
+
+def collect_workbooks(uploads):
+    """
+    ไฟล์ที่อัปโหลด (.xlsx / .zip ที่มี .xlsx ข้างใน) → [(ชื่อไฟล์, bytes)]
+    """
+    workbooks = []
+    total = 0
+
+    for upload in uploads:
+        if not upload or not upload.filename:
+            continue
+        data = upload.read()
+
+        if not upload.filename.lower().endswith(".zip"):
+            workbooks.append((upload.filename, data))
+            total += len(data)
+            continue
 
-    for _, row in df.iterrows():
         try:
-            cursor.execute("""
-                INSERT INTO assets (
-                    asset_no,
-                    asset_type,
-                    asset_model,
-                    serial_no,
-                    mac_address,
-                    hostname,
-                    owner_name,
-                    position,
-                    department,
-                    status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                str(row["เลขครุภัณฑ์"]),
-                str(row["ประเภทเครื่อง"]),
-                str(row["ยี่ห้อ/รุ่น"]),
-                str(row["Serial Number"]),
-                str(row["Mac Address"]),
-                str(row["ชื่อเครื่อง"]),
-                str(row["ผู้ครอบครอง"]),
-                str(row["ตำแหน่ง"]),
-                dept_short,   # ✅ ใช้ค่าจากไฟล์จริง
-                "ใช้งาน"
-            ))
-            count += 1
-        except Exception as e:
-            print("❌ ข้ามแถว:", e)
+            zf = ZipFile(io.BytesIO(data))
+        except BadZipFile:
+            raise ImportFileError(f"{upload.filename}: ไฟล์ ZIP เปิดไม่ได้")
+
+        with zf:
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                # ข้ามโฟลเดอร์ / ไฟล์ระบบของ macOS / ไฟล์ lock ของ Excel (~$...)
+                if (info.is_dir() or info.filename.startswith("__MACOSX/")
+                        or name.startswith(("~$", "."))
+                        or not name.lower().endswith(".xlsx")):
+                    continue
+                total += info.file_size
+                if total > IMPORT_MAX_BYTES:
+                    raise ImportFileError("ไฟล์รวมกันใหญ่เกินไป")
+                workbooks.append((name, zf.read(info)))
+
+    if total > IMPORT_MAX_BYTES:
+        raise ImportFileError("ไฟล์รวมกันใหญ่เกินไป")
+    if not workbooks:
+        raise ImportFileError("ไม่พบไฟล์ Excel (.xlsx)")
+
+    # ชื่อซ้ำ (คนละ ZIP / คนละโฟลเดอร์) → เติมลำดับ ให้สรุปรายไฟล์แยกกันได้
+    seen = {}
+    for i, (name, data) in enumerate(workbooks):
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            workbooks[i] = (f"{name} ({seen[name]})", data)
+    return workbooks
+
+
+def _parse_asset_workbook(data):
+    # รันใน process ลูก: bytes ของไฟล์ → (ชื่อหน่วยงานเต็ม, แถวที่จัดรูปแบบแล้ว, แถวที่ผิด)
+    dept_full, records = read_asset_sheet(io.BytesIO(data))
+    return (dept_full, *validate_asset_rows(records))
+
+
+def _parsed(name, dept_full=None, rows=(), row_errors=(), error=None):
+    return {
+        "name": name,
+        "dept_full": dept_full,
+        "rows": list(rows),
+        "row_errors": list(row_errors),     # ข้อมูลผิดรายแถว → ไม่บันทึกไฟล์นี้
+        "error": error,                     # อ่านไฟล์ไม่ได้ทั้งไฟล์
+    }
 
-    conn.commit()
-    conn.close()
 
-    return f"อิมพอร์ตสำเร็จ {count} รายการ ({dept_short})"
+def parse_asset_workbooks(workbooks):
+    """
+    อ่าน + ตรวจทุกไฟล์พร้อมกัน → yield ผลรายไฟล์ (_parsed) ตามลำดับที่เสร็จ
+    ไฟล์เดียว → ทำใน process นี้เลย
+    """
+    if len(workbooks) == 1:
+        name, data = workbooks[0]
+        try:
+            yield _parsed(name, *_parse_asset_workbook(data))
+        except ImportFileError as e:
+            yield _parsed(name, error=str(e))
+        return
+
+    pool = process_pool()
+    futures = {
+        pool.submit(_parse_asset_workbook, data): name
+        for name, data in workbooks
+    }
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            result = future.result()
+        except ImportFileError as e:
+            yield _parsed(name, error=str(e))
+        except BrokenProcessPool:
+            app.logger.exception("อ่านไฟล์นำเข้า %s ไม่สำเร็จ", name)
+            _discard_process_pool(pool)
+            yield _parsed(name, error="อ่านไฟล์ไม่สำเร็จ")
+        except Exception:
+            app.logger.exception("อ่านไฟล์นำเข้า %s ไม่สำเร็จ", name)
+            yield _parsed(name, error="อ่านไฟล์ไม่สำเร็จ")
+        else:
+            yield _parsed(name, *result)
+
+
+def importable(parsed):
+    return not parsed["error"] and not parsed["row_errors"]
+
+
+# ==================================================
+# นำเข้าแบบอัปเดต (upsert): ดูตัวอย่างความต่างก่อน แล้วค่อยบันทึก
+# ==================================================
+import json
+import time
+
+IMPORT_STAGING_DIR = "imports"
+IMPORT_STAGING_MAX_AGE = 3600       # ไฟล์รอยืนยันเก็บไว้ 1 ชม.
+IMPORT_DIFF_SAMPLE = 200            # แถวตัวอย่างที่แสดงต่อกลุ่ม
+
+# คอลัมน์ที่เทียบ / อัปเดต (สถานะไม่อยู่ในไฟล์ → คงค่าเดิม)
+ASSET_UPSERT_COLUMNS = [c for c, _ in ASSET_IMPORT_COLUMNS] + ["department"]
+ASSET_UPSERT_LABELS = dict(ASSET_IMPORT_COLUMNS, department="หน่วยงาน")
+
+
+def _asset_changed(old, new):
+    # NULL ในตารางเดิม = ช่องว่างในไฟล์
+    return " OR ".join(
+        f"COALESCE({old}.{c}, '') <> {new}.{c}" for c in ASSET_UPSERT_COLUMNS[1:]
+    )
+
+
+def stage_asset_import(conn, files):
+    """
+    โหลดแถวจากทุกไฟล์ลงตารางชั่วคราว temp.asset_import (อยู่เฉพาะ connection นี้)
+    files = [(ชื่อไฟล์, หน่วยงาน, แถว)]
+    เลขครุภัณฑ์ซ้ำ (ในไฟล์เดียวกัน / ข้ามไฟล์) → ใช้แถวแรก (เหมือนโหมดเพิ่มใหม่)
+    """
+    conn.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS asset_import (
+            asset_no TEXT PRIMARY KEY,
+            {", ".join(f"{c} TEXT" for c in ASSET_UPSERT_COLUMNS[1:])},
+            source TEXT
+        )
+    """)
+    conn.execute("DELETE FROM temp.asset_import")
+
+    columns = ASSET_UPSERT_COLUMNS + ["source"]
+    sql = f"""
+        INSERT OR IGNORE INTO temp.asset_import ({", ".join(columns)})
+        VALUES ({", ".join("?" * len(columns))})
+    """
+    for name, department, records in files:
+        records = iter(records)
+        while True:
+            batch = [
+                (*r, department, name)
+                for r in itertools.islice(records, IMPORT_BATCH)
+            ]
+            if not batch:
+                break
+            conn.executemany(sql, batch)
+
+
+def asset_import_diff(conn):
+    """
+    เทียบ temp.asset_import กับ assets (join ด้วยเลขครุภัณฑ์ ทั้งชุดใน SQL)
+    คืน {"inserts": n, "updates": n, "unchanged": n, "files": {ชื่อไฟล์: จำนวนแต่ละแบบ},
+         "insert_rows": [...], "update_rows": [{"asset_no", "changes": [(หัวข้อ, เดิม, ใหม่)]}]}
+    """
+    changed = _asset_changed("a", "i")
+    per_file = {
+        r[0]: {"inserts": r[1], "updates": r[2], "unchanged": r[3]}
+        for r in conn.execute(f"""
+            SELECT
+                i.source,
+                SUM(a.id IS NULL),
+                SUM(a.id IS NOT NULL AND ({changed})),
+                SUM(a.id IS NOT NULL AND NOT ({changed}))
+            FROM temp.asset_import i
+            LEFT JOIN assets a ON a.asset_no = i.asset_no
+            GROUP BY i.source
+        """)
+    }
+    counts = [
+        sum(f[k] for f in per_file.values())
+        for k in ("inserts", "updates", "unchanged")
+    ]
+
+    insert_rows = conn.execute("""
+        SELECT i.*
+        FROM temp.asset_import i
+        LEFT JOIN assets a ON a.asset_no = i.asset_no
+        WHERE a.id IS NULL
+        ORDER BY i.rowid
+        LIMIT ?
+    """, (IMPORT_DIFF_SAMPLE,)).fetchall()
+
+    cols = ASSET_UPSERT_COLUMNS[1:]
+    update_rows = []
+    for r in conn.execute(f"""
+        SELECT
+            i.asset_no,
+            {", ".join(f"COALESCE(a.{c}, '')" for c in cols)},
+            {", ".join(f"i.{c}" for c in cols)}
+        FROM temp.asset_import i
+        JOIN assets a ON a.asset_no = i.asset_no
+        WHERE {changed}
+        ORDER BY i.rowid
+        LIMIT ?
+    """, (IMPORT_DIFF_SAMPLE,)):
+        old, new = r[1:1 + len(cols)], r[1 + len(cols):]
+        update_rows.append({
+            "asset_no": r[0],
+            "changes": [
+                (ASSET_UPSERT_LABELS[c], o, n)
+                for c, o, n in zip(cols, old, new) if o != n
+            ],
+        })
+
+    return {
+        "inserts": counts[0],
+        "updates": counts[1],
+        "unchanged": counts[2],
+        "files": per_file,
+        "insert_rows": insert_rows,
+        "update_rows": update_rows,
+    }
+
+
+def apply_asset_import(conn):
+    # เลขใหม่ → เพิ่ม / เลขเดิมที่ข้อมูลต่าง → อัปเดต / เหมือนเดิม → ไม่แตะ
+    columns = ", ".join(ASSET_UPSERT_COLUMNS)
+    updates = ", ".join(f"{c} = excluded.{c}" for c in ASSET_UPSERT_COLUMNS[1:])
+    conn.execute(f"""
+        INSERT INTO assets ({columns}, status)
+        SELECT {columns}, 'ใช้งาน'
+        FROM temp.asset_import
+        WHERE true
+        ON CONFLICT (asset_no) DO UPDATE SET {updates}
+        WHERE {_asset_changed("assets", "excluded")}
+    """)
+
+
+def save_staged_import(data):
+    # เก็บแถวที่อ่านแล้วไว้รอยืนยัน (ไม่ต้องอัปโหลด / อ่านไฟล์ซ้ำ)
+    os.makedirs(IMPORT_STAGING_DIR, exist_ok=True)
+
+    now = time.time()
+    for entry in os.scandir(IMPORT_STAGING_DIR):
+        try:
+            if now - entry.stat().st_mtime > IMPORT_STAGING_MAX_AGE:
+                _remove_quietly(entry.path)
+        except OSError:
+            pass
+
+    token = uuid.uuid4().hex
+    with open(os.path.join(IMPORT_STAGING_DIR, f"{token}.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    return token
+
+
+def staged_import_path(token):
+    # token มาจากฟอร์ม → รับเฉพาะ hex กัน path แปลก ๆ
+    if not token or not all(c in "0123456789abcdef" for c in token):
+        return None
+    path = os.path.join(IMPORT_STAGING_DIR, f"{token}.json")
+    return path if os.path.exists(path) else None
+
+
+def staged_files(staged):
+    # ไฟล์ที่อ่านได้และข้อมูลถูกต้อง → [(ชื่อไฟล์, หน่วยงาน, แถว)] สำหรับ stage_asset_import
+    return [
+        (f["name"], f["department"], f["rows"])
+        for f in staged["files"] if importable(f)
+    ]
+
+
+def render_import_preview(token, staged, diff, stale=False):
+    return render_template(
+        "assets_import_preview.html",
+        token=token,
+        files=staged["files"],
+        total=sum(len(f["rows"]) for f in staged["files"]),
+        diff=diff,
+        sample=IMPORT_DIFF_SAMPLE,
+        labels=ASSET_UPSERT_LABELS,
+        columns=ASSET_UPSERT_COLUMNS,
+        stale=stale,
+    )
+
+
+@app.route("/assets/import", methods=["POST"])
+def assets_import():
+    try:
+        workbooks = collect_workbooks(request.files.getlist("file"))
+    except ImportFileError as e:
+        return str(e), 400
+
+    upsert = request.form.get("mode") == "upsert"
+    conn = get_db()
+    files = []
+
+    # ===== อ่าน + ตรวจหลายไฟล์พร้อมกันใน process pool / เขียนที่ thread นี้ที่เดียว =====
+    for result in parse_asset_workbooks(workbooks):
+        dept_full = result["dept_full"]
+        result["department"] = get_department_short(dept_full) if dept_full else None
+        if not upsert and importable(result):
+            # ไฟล์ไหนอ่านเสร็จก่อนเขียนก่อน (1 transaction ต่อไฟล์)
+            result["inserted"] = insert_assets(conn, result["department"], result["rows"])
+        files.append(result)
+
+    files.sort(key=lambda f: f["name"])
+    single = len(files) == 1
+    if single and files[0]["error"]:
+        return files[0]["error"], 400
+
+    if not upsert:
+        if single and importable(files[0]):
+            return f"อิมพอร์ตสำเร็จ {files[0]['inserted']} รายการ ({files[0]['department']})"
+        # ไฟล์เดียวที่ข้อมูลผิด → 400 พร้อมรายงานรายแถว
+        status = 400 if single else 200
+        return render_template("assets_import_result.html", files=files), status
+
+    # ===== upsert: ยังไม่บันทึก แสดงตัวอย่างก่อน =====
+    staged = {"version": table_version(conn, "assets"), "files": files}
+    stage_asset_import(conn, staged_files(staged))
+    diff = asset_import_diff(conn)
+    conn.rollback()     # แถวใน temp ใช้แค่คำนวณ
+
+    return render_import_preview(save_staged_import(staged), staged, diff)
+
+
+@app.route("/assets/import/apply", methods=["POST"])
+def assets_import_apply():
+    token = request.form.get("token", "")
+    path = staged_import_path(token)
+    if path is None:
+        return "ไม่พบข้อมูลที่รอยืนยัน (หมดอายุหรือบันทึกไปแล้ว) กรุณาอัปโหลดใหม่", 404
+
+    with open(path, encoding="utf-8") as f:
+        staged = json.load(f)
+
+    conn = get_db()
+    with write_tx(conn):
+        stage_asset_import(conn, staged_files(staged))
+        diff = asset_import_diff(conn)
+        version = table_version(conn, "assets")
+
+        # ครุภัณฑ์ถูกแก้หลังดูตัวอย่าง → ไม่บันทึก ให้ดูความต่างชุดใหม่ก่อน
+        stale = version != staged["version"]
+        if not stale:
+            apply_asset_import(conn)
+
+    if stale:
+        staged["version"] = version
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(staged, f, ensure_ascii=False)
+        return render_import_preview(token, staged, diff, stale=True)
+
+    _remove_quietly(path)
+    # เฉพาะไฟล์ที่บันทึกจริง (ไฟล์ที่มีแถวผิดไม่นับ) / ไม่มีชื่อหน่วยงาน → แสดงว่าไม่ระบุ
+    departments = ", ".join(
+        sorted({department or "ไม่ระบุหน่วยงาน" for _, department, _ in staged_files(staged)})
+    )
+    return (
+        f"อัปเดตสำเร็จ เพิ่ม {diff['inserts']} / แก้ไข {diff['updates']} / "
+        f"ไม่เปลี่ยน {diff['unchanged']} รายการ ({departments})"
+    )
 
 
 # =========================
 # ลงเวลา
 # =========================
 
-@app.route("/attendance", methods=["GET"])
-def attendance_page():
-    now = datetime.now()
-    from calendar import monthrange
+def attendance_period(month, now):
+    """
+    เดือนที่เลือก → (ปี, เดือน)
+    ไม่เลือก = เดือนปัจจุบัน / เลือกเดือนที่ยังมาไม่ถึง = ของปีที่แล้ว
+    """
+    if not month:
+        return now.year, now.month
+    if month > now.month:
+        return now.year - 1, month
+    return now.year, month
 
-    current_year = now.year
-    current_month = now.month
 
-    # ✅ รับค่าเดือนจาก query
-    month = request.args.get("month", type=int)
+def attendance_export_period(args):
+    # ระบุปีมาด้วย (ตอนปิดเดือน) → ใช้ตามนั้น / ไม่ระบุ → ตามหน้าลงเวลา
+    month = args.get("month", type=int)
+    year = args.get("year", type=int)
+    if month and year:
+        return year, month
+    return attendance_period(month, datetime.now())
 
-    if month:
-        # ถ้าเลือกเดือนมากกว่าเดือนปัจจุบัน → ปีที่แล้ว
-        if month > current_month:
-            year = current_year - 1
-        else:
-            year = current_year
-    else:
-        month = current_month
-        year = current_year
 
+@app.route("/attendance", methods=["GET"])
+def attendance_page():
+    now = datetime.now()
+    from calendar import monthrange
 
+    # ✅ รับค่าเดือนจาก query
+    year, month = attendance_period(request.args.get("month", type=int), now)
 
     month_start = f"{year}-{month:02d}-01"
     last_day = monthrange(year, month)[1]
@@ -354,8 +1376,7 @@ def attendance_page():
 
     selected_staff = request.args.get("staff_name", "")
 
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
     if selected_staff:
@@ -375,7 +1396,6 @@ def attendance_page():
         """, (month_start, month_end))
 
     records = cur.fetchall()
-    conn.close()
 
     today_th = format_date_th_short(now.strftime("%Y-%m-%d"))
 
@@ -396,6 +1416,179 @@ from flask import send_file
 import io
 from calendar import monthrange
 
+# ==================================================
+# export engine: รูปแบบรายงาน = spec (คอลัมน์ / style / หน้ากระดาษ)
+# ==================================================
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Side, Font, NamedStyle, PatternFill
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.styles.fills import DEFAULT_EMPTY_FILL
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.worksheet import Worksheet
+
+THIN = Side(style="thin")
+BOX = Border(left=THIN, right=THIN, top=THIN, bottom=THIN)
+CENTER = Alignment(horizontal="center", vertical="center")
+CENTER_WRAP = Alignment(horizontal="center", vertical="center", wrap_text=True)
+
+ROW_NO = "#"        # คอลัมน์ลำดับ 1, 2, 3…
+
+
+def export_column(header, width=None, value=None, image=None):
+    """
+    คอลัมน์ของตารางข้อมูล
+    value = ชื่อคอลัมน์ใน row / ฟังก์ชัน (row) → ค่า / ROW_NO / None (ช่องว่าง)
+    image = ฟังก์ชัน (row) → (path, กว้าง, สูง) หรือ None  (วางรูปในช่องนั้น)
+    """
+    if isinstance(value, str) and value != ROW_NO:
+        key = value
+        value = lambda row: row[key]
+    return {"header": header, "width": width, "value": value, "image": image}
+
+
+def sheet_row(values=(), style=None, height=None, merge=None, start=1):
+    """
+    แถวที่ไม่ใช่ข้อมูล (หัวรายงาน / แถวว่าง / แถวรวม / ลายเซ็น)
+    values เริ่มที่คอลัมน์ start, merge = (คอลัมน์แรก, คอลัมน์สุดท้าย)
+    """
+    return {
+        "values": list(values), "style": style, "height": height,
+        "merge": merge, "start": start,
+    }
+
+
+def apply_page_setup(ws, page):
+    if "orientation" in page:
+        ws.page_setup.paperSize = Worksheet.PAPERSIZE_A4
+        ws.page_setup.orientation = page["orientation"]
+    if page.get("fit"):
+        ws.page_setup.fitToHeight = 1
+        ws.page_setup.fitToWidth = 1
+    if "margins" in page:
+        m = ws.page_margins
+        m.left, m.right, m.top, m.bottom = page["margins"]
+    if "print_title_rows" in page:
+        ws.print_title_rows = page["print_title_rows"]
+    if "row_height" in page:
+        # ความสูงเท่ากันทุกแถว
+        ws.sheet_format.defaultRowHeight = page["row_height"]
+        ws.sheet_format.customHeight = True
+
+
+def write_export(spec, path, rows, title=(), footer=(), widths=None,
+                 progress=None, total=None):
+    """
+    เขียน workbook ตาม spec ลง path (write-only: ทีละแถว ไม่เก็บทั้งชีต)
+
+    spec = {
+        "sheet": ชื่อชีต,
+        "styles": {ชื่อ: dict(font=, alignment=, border=, fill=)},
+        "columns": [export_column(...)],
+        "header": {"style":, "height":}, "body": {"style":, "height":},
+        "page": {...} (apply_page_setup), "images": [(path, กว้าง, สูง, ช่อง)],
+    }
+    title / footer = [sheet_row(...)] ก่อนหัวตาราง / หลังข้อมูล
+    """
+    progress = progress or no_progress
+    columns = spec["columns"]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(spec["sheet"])
+
+    # ===== NamedStyle: ลงทะเบียนครั้งเดียวต่อ workbook =====
+    for name, attrs in spec["styles"].items():
+        wb.add_named_style(NamedStyle(
+            name=name,
+            font=attrs.get("font", DEFAULT_FONT),
+            alignment=attrs.get("alignment"),
+            border=attrs.get("border", DEFAULT_BORDER),
+            fill=attrs.get("fill", DEFAULT_EMPTY_FILL),
+        ))
+
+    # ===== ต้องตั้งก่อนเขียนแถวแรก =====
+    apply_page_setup(ws, spec.get("page", {}))
+    for i, w in enumerate(widths or [c["width"] for c in columns], start=1):
+        if w:
+            ws.column_dimensions[get_column_letter(i)].width = w
+
+    images = {}
+    for img_path, img_w, img_h, anchor in spec.get("images", ()):
+        ws.add_image(workbook_image(images, img_path, img_w, img_h), anchor)
+
+    # cell ที่ใส่ style แล้ว ใช้ซ้ำทุกแถว (เขียนลงไฟล์ทันทีตอน append)
+    # → ไม่ต้องสร้าง cell / ตั้ง style ใหม่ทีละช่อง
+    templates = {}
+
+    def cells_for(style, count):
+        cells = templates.setdefault(style, [])
+        while len(cells) < count:
+            cell = WriteOnlyCell(ws)
+            cell.style = style
+            cells.append(cell)
+        return cells
+
+    row_idx = 0
+
+    def put(values, style=None, height=None, merge=None, start=1):
+        nonlocal row_idx
+        row_idx += 1
+        if height:
+            ws.row_dimensions[row_idx].height = height
+        if merge:
+            ws.merged_cells.add(CellRange(
+                min_col=merge[0], max_col=merge[1], min_row=row_idx, max_row=row_idx
+            ))
+
+        line = [None] * (start - 1)
+        if style is None:
+            line.extend(values)
+        else:
+            cells = cells_for(style, start - 1 + len(values))
+            for cell, value in zip(cells[start - 1:], values):
+                cell.value = value
+                line.append(cell)
+        ws.append(line)
+        # แถวนี้ลงไฟล์แล้ว ไม่ต้องเก็บความสูงไว้ (ไม่งั้นโตตามจำนวนแถว)
+        ws.row_dimensions.pop(row_idx, None)
+
+    for r in title:
+        put(**r)
+
+    header = spec["header"]
+    put([c["header"] for c in columns], header["style"], header.get("height"))
+
+    body = spec["body"]
+    image_columns = [
+        (get_column_letter(i), c["image"])
+        for i, c in enumerate(columns, start=1) if c["image"]
+    ]
+
+    for no, row in enumerate(rows, start=1):
+        put(
+            [
+                no if c["value"] == ROW_NO else (c["value"](row) if c["value"] else None)
+                for c in columns
+            ],
+            body["style"], body.get("height"),
+        )
+        for letter, image in image_columns:
+            img = image(row)
+            if img:
+                ws.add_image(workbook_image(images, *img), f"{letter}{row_idx}")
+        if total and no % 500 == 0:
+            progress(no, total)
+
+    for r in footer:
+        put(**r)
+
+    save_export(wb, path)
+
+
+
+
 # =========================
 # export เวลาทำงาน
 # =========================
@@ -407,34 +1600,78 @@ import io
 
 @app.route("/attendance/export")
 def export_attendance_excel():
-    staff_name = request.args.get("staff_name")
-    if not staff_name:
-        return "กรุณาเลือกชื่อเจ้าหน้าที่", 400
-
-    now = datetime.now()
-    current_year = now.year
-    current_month = now.month
+    return respond_export(build_attendance_export, request.args, attendance_snapshot_key)
+
+
+ATTENDANCE_EXPORT = {
+    "sheet": "ใบลงเวลา",
+    # A4 แนวตั้ง + บีบ 1 หน้า
+    "page": {
+        "orientation": "portrait",
+        "fit": True,
+        "margins": (0.5, 0.5, 0.6, 0.6),
+    },
+    "images": [("static/img/logo.png", 115, 60, "A1")],
+    "styles": {
+        "att_title": dict(font=Font(bold=True, size=13), alignment=CENTER),
+        "att_org": dict(font=Font(bold=True, size=12), alignment=CENTER),
+        "att_month": dict(font=Font(size=11), alignment=CENTER),
+        "att_name": dict(
+            font=Font(size=11),
+            alignment=Alignment(horizontal="left", vertical="center"),
+        ),
+        "att_header": dict(font=Font(bold=True), alignment=CENTER, border=BOX),
+        "att_body": dict(alignment=CENTER, border=BOX),
+        "att_sign": dict(font=Font(size=11), alignment=CENTER),
+        "att_sign_name": dict(font=Font(size=10), alignment=CENTER),
+    },
+    "header": {"style": "att_header", "height": 22},
+    "body": {"style": "att_body"},
+    "columns": [
+        export_column("วันที่", 6, "day"),
+        export_column("เวลาเข้า", 12, "time_in"),
+        export_column("เวลาออก", 12, "time_out"),
+        ##### ลายเซ็น 838 x 130 → 160 x 16 #####
+        export_column("ลายมือชื่อ", 22, image=lambda r: r["signature"]),
+        export_column("หมายเหตุ", 22),
+    ],
+}
 
-    month = request.args.get("month", type=int)
 
-    if month:
-        if month > current_month:
-            year = current_year - 1
-        else:
-            year = current_year
-    else:
-        month = current_month
-        year = current_year
+def build_attendance_export(args, progress=None):
+    staff_name = args.get("staff_name")
+    if not staff_name:
+        raise ExportError("กรุณาเลือกชื่อเจ้าหน้าที่")
 
+    year, month = attendance_export_period(args)
 
     # ===== ช่วงวันที่ของเดือน =====
     last_day = monthrange(year, month)[1]
     month_start = f"{year}-{month:02d}-01"
     month_end = f"{year}-{month:02d}-{last_day}"
 
+    filename = f"ใบลงเวลา_{staff_name}_{format_month_th(year, month)}.xlsx"
+
+    # ===== ลายเซ็น (mtime อยู่ใน key → เปลี่ยนรูปแล้วได้ไฟล์ใหม่) =====
+    signature_path = f"static/signatures/{staff_name}.png"
+
+    # กันพัง ถ้าไม่มีไฟล์ลายเซ็น
+    if os.path.exists(signature_path):
+        signature_mtime = os.path.getmtime(signature_path)
+    else:
+        signature_path = signature_mtime = None
+
+    conn = get_db()
+    path = export_cache_path(
+        conn, "attendance",
+        {"staff": staff_name, "year": year, "month": month,
+         "signature": signature_mtime},
+        ["attendance"]
+    )
+    if os.path.exists(path):
+        return path, filename
+
     # ===== ดึงข้อมูล =====
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     cur.execute("""
         SELECT work_date, time_in, time_out
@@ -443,155 +1680,175 @@ def export_attendance_excel():
           AND work_date BETWEEN ? AND ?
     """, (staff_name, month_start, month_end))
     rows = cur.fetchall()
-    conn.close()
 
     attendance_map = {int(r["work_date"].split("-")[2]): r for r in rows}
 
-    # ===== Workbook =====
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "ใบลงเวลา"
-
-    # ===== ตั้งค่าหน้ากระดาษ A4 แนวตั้ง + บีบ 1 หน้า =====
-    ws.page_setup.paperSize = ws.PAPERSIZE_A4
-    ws.page_setup.orientation = ws.ORIENTATION_PORTRAIT
-
-    ws.page_setup.fitToHeight = 1
-    ws.page_setup.fitToWidth = 1
-    ws.page_setup.scale = None   # สำคัญ: ให้ fit ทำงานจริง
-
-    ws.page_margins.left = 0.5
-    ws.page_margins.right = 0.5
-    ws.page_margins.top = 0.6
-    ws.page_margins.bottom = 0.6
-
-    # ===== Style =====
-    center = Alignment(horizontal="center", vertical="center")
-    left = Alignment(horizontal="left", vertical="center")
-    bold = Font(bold=True)
-    thin = Side(style="thin")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-
-    # ===== คอลัมน์ A = โลโก้ =====
-    ws.column_dimensions["A"].width = 16
-
-    logo = XLImage("static/img/logo.png")
-    logo.height = 60
-    logo.width = 115
-    ws.add_image(logo, "A1")
-
-    # ===== หัวกระดาษ =====
-    ws.merge_cells("B1:F1")
-    ws.merge_cells("B2:F2")
-    ws.merge_cells("B3:F3")
-    ws.merge_cells("C4:F4")
-
-    ws["B1"] = "ใบลงเวลาปฏิบัติงานของเจ้าหน้าที่ประจำหน่วยงาน"
-    ws["B1"].alignment = center
-    ws["B1"].font = Font(bold=True, size=13)
-
-    ws["B2"] = "กรมคุ้มครองสิทธิและเสรีภาพ"
-    ws["B2"].alignment = center
-    ws["B2"].font = Font(bold=True, size=12)
-
-    ws["B3"] = f"ประจำเดือน {format_month_th(year, month)}"
-    ws["B3"].alignment = center
-    ws["B3"].font = Font(size=11)
-
-    ws["C4"] = f"ชื่อเจ้าหน้าที่ : {staff_name}"
-    ws["C4"].alignment = left
-    ws["C4"].font = Font(size=11)
-
-    ws.row_dimensions[1].height = 26
-    ws.row_dimensions[2].height = 22
-    ws.row_dimensions[3].height = 20
-    ws.row_dimensions[4].height = 20
-
-    # ===== ตาราง =====
-    start_row = 6
-    ws.row_dimensions[start_row].height = 22
-
-    headers = ["วันที่", "เวลาเข้า", "เวลาออก", "ลายมือชื่อ", "หมายเหตุ"]
-    widths = {
-        1: 6,
-        2: 12,
-        3: 12,
-        4: 22,
-        5: 22
-    }
+    # ===== ข้อมูลรายวัน (ทุกวันในเดือน) =====
+    def days():
+        for day in range(1, last_day + 1):
+            record = attendance_map.get(day)
+            if not record:
+                yield {"day": day, "time_in": None, "time_out": None, "signature": None}
+                continue
+
+            time_in = record["time_in"]
+            time_out = record["time_out"]
+            # ใส่ลายเซ็นเฉพาะวันที่มาทำงานจริง
+            worked = (time_in or time_out) and signature_path
+            yield {
+                "day": day,
+                "time_in": time_in or "",
+                "time_out": time_out or "",
+                "signature": (signature_path, 160, 16) if worked else None,
+            }
 
-    for col, h in enumerate(headers, start=1):
-        cell = ws.cell(row=start_row, column=col, value=h)
-        cell.alignment = center
-        cell.font = bold
-        cell.border = border
-        ws.column_dimensions[chr(64 + col)].width = widths[col]
+    last_col = 6      # หัวกระดาษ / ลายเซ็น merge ถึงคอลัมน์ F
+    title = [
+        sheet_row(["ใบลงเวลาปฏิบัติงานของเจ้าหน้าที่ประจำหน่วยงาน"],
+                  "att_title", 26, merge=(2, last_col), start=2),
+        sheet_row(["กรมคุ้มครองสิทธิและเสรีภาพ"],
+                  "att_org", 22, merge=(2, last_col), start=2),
+        sheet_row([f"ประจำเดือน {format_month_th(year, month)}"],
+                  "att_month", 20, merge=(2, last_col), start=2),
+        sheet_row([f"ชื่อเจ้าหน้าที่ : {staff_name}"],
+                  "att_name", 20, merge=(3, last_col), start=3),
+        sheet_row(),
+    ]
+    footer = [
+        sheet_row(),
+        sheet_row(["ลายเซ็นเจ้าหน้าที่ ............................................................."],
+                  "att_sign", 24, merge=(2, last_col), start=2),
+        sheet_row(["(....................................................................................)"],
+                  "att_sign_name", 22, merge=(2, last_col), start=2),
+    ]
 
-    # ===== ข้อมูลรายวัน =====
-    import os
-    signature_path = f"static/signatures/{staff_name}.png"
+    write_export(ATTENDANCE_EXPORT, path, days(), title=title, footer=footer)
+    return path, filename
 
-    # กันพัง ถ้าไม่มีไฟล์ลายเซ็น
-    if not os.path.exists(signature_path):
-        signature_path = None
 
-    for day in range(1, last_day + 1):
-        r = start_row + day
+# =========================
+# export เวลาทำงาน ทุกคนในเดือน (ZIP)
+# =========================
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import quote
+from zipfile import ZipFile
+from flask import Response
+from werkzeug.datastructures import MultiDict
+
+PROCESS_POOL_WORKERS = min(4, os.cpu_count() or 1)
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def process_pool():
+    # ใช้ร่วมกัน: ใบลงเวลาทุกคน (ZIP) / อ่านไฟล์นำเข้าครุภัณฑ์หลายไฟล์
+    # สร้างตอนใช้ครั้งแรก (spawn: ไม่ fork ทั้ง process ที่มี thread/connection อยู่)
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
 
-        ws.cell(row=r, column=1, value=day).alignment = center
 
-        record = attendance_map.get(day)
-        if record:
-            time_in = record["time_in"]
-            time_out = record["time_out"]
+def _discard_process_pool(pool):
+    # process ลูกตาย → pool ใช้ต่อไม่ได้อีก ทิ้งไปให้ครั้งหน้าสร้างใหม่
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False)
 
-            ws.cell(row=r, column=2, value=time_in or "")
-            ws.cell(row=r, column=3, value=time_out or "")
 
-            # ใส่ลายเซ็นเฉพาะวันที่มาทำงานจริง
-            if time_in or time_out:
-                if signature_path:
-                    sig = XLImage(signature_path)
-                    sig.width = 160 ##### 838 x 130 #####
-                    sig.height = 16
-                    ws.add_image(sig, f"D{r}")
-
-        # เส้นตาราง (ทุกวัน)
-        for c in range(1, 6):
-            ws.cell(row=r, column=c).border = border
-            ws.cell(row=r, column=c).alignment = center
-
-    # ===== ลายเซ็น =====
-    sign_row = start_row + last_day + 2
-    ws.merge_cells(f"B{sign_row}:F{sign_row}")
-    ws.row_dimensions[sign_row].height = 24
-    ws[f"B{sign_row}"] = "ลายเซ็นเจ้าหน้าที่ ............................................................."
-    ws[f"B{sign_row}"].alignment = center
-    ws[f"B{sign_row}"].font = Font(size=11)
-
-    name_row = sign_row + 1
-    ws.merge_cells(f"B{name_row}:F{name_row}")
-    ws.row_dimensions[name_row].height = 22
-    ws[f"B{name_row}"] = "(....................................................................................)"
-    ws[f"B{name_row}"].alignment = center
-    ws[f"B{name_row}"].font = Font(size=10)
-
-    # ===== ส่งไฟล์ =====
-    stream = io.BytesIO()
-    wb.save(stream)
-    stream.seek(0)
+def _attendance_sheet_worker(staff_name, year, month):
+    # รันใน process ลูก → ได้ไฟล์ใน reports/cache/ (ใช้ cache ร่วมกับ /attendance/export)
+    # ส่งปีไปด้วย → process ลูกไม่ต้องเดาปีเอง (เดือนของปีก่อนตอนต้นปี)
+    with app.app_context():
+        return build_attendance_export(
+            MultiDict({"staff_name": staff_name, "year": year, "month": month})
+        )
 
-    filename = f"ใบลงเวลา_{staff_name}_{format_month_th(year, month)}.xlsx"
 
-    return send_file(
-        stream,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+class _ZipStream:
+    # ให้ ZipFile เขียนลงตรงนี้ แล้วค่อย yield ออกไปทีละไฟล์ (ไม่ต้อง seek)
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
 
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+@app.route("/attendance/export-all")
+def export_attendance_all():
+    """
+    ใบลงเวลาของทุกคนที่มีข้อมูลในเดือนนั้น → ZIP (1 ไฟล์ Excel ต่อคน)
+    สร้างพร้อมกันใน process pool แล้วส่งออกทีละไฟล์ตามที่เสร็จก่อน
+    """
+    year, month = attendance_export_period(request.args)
+    last_day = monthrange(year, month)[1]
 
+    staff_names = [
+        r[0] for r in get_db().execute("""
+            SELECT DISTINCT staff_name
+            FROM attendance
+            WHERE work_date BETWEEN ? AND ?
+            ORDER BY staff_name
+        """, (f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last_day}"))
+    ]
+    if not staff_names:
+        return "ไม่มีข้อมูลลงเวลาในเดือนนี้", 404
+
+    # ส่งงานทันที → process ลูกเริ่มทำระหว่างที่ response เริ่มส่ง
+    pool = process_pool()
+    futures = {
+        pool.submit(_attendance_sheet_worker, name, year, month): name
+        for name in staff_names
+    }
 
+    def generate():
+        out = _ZipStream()
+        # xlsx บีบอัดมาแล้ว → เก็บแบบ STORED ไม่ต้องบีบซ้ำ
+        with ZipFile(out, "w") as zf:
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    path, filename = future.result()
+                except BrokenProcessPool:
+                    app.logger.exception("สร้างใบลงเวลา %s ไม่สำเร็จ", name)
+                    _discard_process_pool(pool)
+                    zf.writestr(f"ผิดพลาด_{name}.txt", "สร้างไฟล์ไม่สำเร็จ")
+                except Exception:
+                    app.logger.exception("สร้างใบลงเวลา %s ไม่สำเร็จ", name)
+                    zf.writestr(f"ผิดพลาด_{name}.txt", "สร้างไฟล์ไม่สำเร็จ")
+                else:
+                    zf.write(path, filename)
+                yield out.take()
+        yield out.take()
+
+    zip_name = f"ใบลงเวลา_{format_month_th(year, month)}.zip"
+    return Response(
+        generate(),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename=attendance_{year}-{month:02d}.zip; "
+                f"filename*=UTF-8''{quote(zip_name)}"
+            )
+        },
+    )
 
 
 from flask import session, request, redirect, render_template, url_for
@@ -624,119 +1881,237 @@ def report_form():
 @app.route("/report", methods=["GET", "POST"], endpoint="save_report")
 def save_report():
     if request.method == "POST":
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
+        form, errors = read_report_form(request.form)
+        if errors:
+            return "ข้อมูลไม่ครบ: " + ", ".join(errors), 400
 
+        conn = get_db()
         created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        work_no = generate_work_no(created_at)
 
-        receive_date = request.form.get("receive_date")
-        receive_time = request.form.get("receive_time")
+        # ===== ลายเซ็น (เขียนไฟล์ก่อน ไม่ถือ lock DB ระหว่างเขียนดิสก์) =====
+        signature_filename = None
+        if form["signature_bytes"]:
+            signature_filename = save_signature_file(form["signature_bytes"])
 
-        receive_datetime = None
-        if receive_date and receive_time:
-            receive_datetime = f"{receive_date} {receive_time}"
+        # ===== เลขงาน + INSERT ใน transaction เดียวกัน =====
+        try:
+            with write_tx(conn):
+                work_no = generate_work_no(conn, created_at)
+                insert_report(conn, work_no, form, signature_filename, created_at)
+        except Exception:
+            # บันทึกไม่สำเร็จ → ไม่ทิ้งไฟล์ลายเซ็นกำพร้าไว้
+            if signature_filename:
+                remove_signature_file(signature_filename)
+            raise
 
-        completed_datetime = None
-        completed_date = request.form.get("complete_date")
-        completed_time = request.form.get("complete_time")
+        return redirect("/list?success=save")
 
-        if completed_date and completed_time:
-            completed_datetime = f"{completed_date} {completed_time}"
+    return render_template("report.html")
 
-        # ===== ลายเซ็น =====
-        signature_filename = None
-        signature_data = request.form.get("signature")
-        if signature_data and "," in signature_data:
-            try:
-                img_bytes = base64.b64decode(signature_data.split(",")[1])
-                os.makedirs("static/signatures", exist_ok=True)
-                signature_filename = f"{uuid.uuid4().hex}.png"
-                with open(f"static/signatures/{signature_filename}", "wb") as f:
-                    f.write(img_bytes)
-            except:
-                signature_filename = None
-
-        confirm_name = request.form.get("confirm_name", "").strip()
-
-        # ===== ดึงชื่อเต็มของหน่วยงาน =====
-        department_short = request.form["department"]
 
-        
+# ==================================================
+# ขั้นตอนบันทึกงาน
+# ==================================================
+SIGNATURE_DIR = os.path.join("static", "signatures")
 
-        cursor.execute(
-            """
-            INSERT INTO reports (
-                work_no,
-                receive_datetime,
-                department,
-                reporter,
-                job_type,
-                asset_no,
-                problem,
-                solution,
-                completed_datetime,
-                close_note,
-                confirm_name,
-                signature,
-                created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                work_no,
-                receive_datetime,
-                department_short,
-                request.form["reporter"],
-                request.form["job_type"],
-                request.form.get("asset_no"),
-                request.form.get("problem"),
-                request.form.get("solution"),
-                completed_datetime,
-                request.form.get("close_note"),
-                confirm_name,
-                signature_filename,
-                created_at,
-            ),
-        )
+REPORT_REQUIRED_FIELDS = {
+    "department": "หน่วยงาน",
+    "reporter": "ผู้แจ้ง",
+    "job_type": "ประเภทงาน",
+}
 
-        conn.commit()
-        fix_signature_column()
-        conn.close()
 
-        return redirect("/list?success=save")
+def read_report_form(f):
+    """
+    อ่าน + ตรวจฟอร์มบันทึกงานให้เสร็จก่อนแตะ DB
+    คืนค่า (form, errors)
+    """
+    errors = [
+        label for field, label in REPORT_REQUIRED_FIELDS.items()
+        if not (f.get(field) or "").strip()
+    ]
 
-    return render_template("report.html")
+    receive_datetime = None
+    if f.get("receive_date") and f.get("receive_time"):
+        receive_datetime = f"{f['receive_date']} {f['receive_time']}"
+
+    completed_datetime = None
+    if f.get("complete_date") and f.get("complete_time"):
+        completed_datetime = f"{f['complete_date']} {f['complete_time']}"
+
+    signature_bytes = None
+    signature_data = f.get("signature")
+    if signature_data and "," in signature_data:
+        try:
+            signature_bytes = base64.b64decode(
+                signature_data.split(",")[1], validate=True
+            )
+        except Exception:
+            signature_bytes = None      # ลายเซ็นเสีย → บันทึกต่อโดยไม่มีลายเซ็น
+
+    form = {
+        "receive_datetime": receive_datetime,
+        "department": (f.get("department") or "").strip(),
+        "reporter": f.get("reporter"),
+        "job_type": f.get("job_type"),
+        "asset_no": f.get("asset_no"),
+        "problem": f.get("problem"),
+        "solution": f.get("solution"),
+        "completed_datetime": completed_datetime,
+        "close_note": f.get("close_note"),
+        "confirm_name": (f.get("confirm_name") or "").strip(),
+        "signature_bytes": signature_bytes,
+    }
+    return form, errors
 
 
+def save_signature_file(img_bytes):
+    os.makedirs(SIGNATURE_DIR, exist_ok=True)
+    filename = f"{uuid.uuid4().hex}.png"
+    with open(os.path.join(SIGNATURE_DIR, filename), "wb") as fh:
+        fh.write(img_bytes)
+    return filename
+
+
+def remove_signature_file(filename):
+    try:
+        os.remove(os.path.join(SIGNATURE_DIR, filename))
+    except OSError:
+        pass
+
+
+def insert_report(conn, work_no, form, signature_filename, created_at):
+    conn.execute(
+        """
+        INSERT INTO reports (
+            work_no,
+            receive_datetime,
+            department,
+            reporter,
+            job_type,
+            asset_no,
+            problem,
+            solution,
+            completed_datetime,
+            close_note,
+            confirm_name,
+            signature,
+            created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            work_no,
+            form["receive_datetime"],
+            form["department"],
+            form["reporter"],
+            form["job_type"],
+            form["asset_no"],
+            form["problem"],
+            form["solution"],
+            form["completed_datetime"],
+            form["close_note"],
+            form["confirm_name"],
+            signature_filename,
+            created_at,
+        ),
+    )
+
 
 # ==================================================
-# รายการ
+# ค้นหา (FTS5)
 # ==================================================
-@app.route("/list")
-def list_reports():
-    from datetime import datetime
-    import math
+_fts_ready = None
 
-    PER_PAGE = 15
 
-    page = request.args.get("page", 1, type=int)
-    q = request.args.get("q", "").strip()
-    job_type = request.args.get("job_type", "")
-    staff = request.args.get("staff")          # 👈 รับค่าจาก work_compare
-    date_from = request.args.get("date_from", "")
-    date_to = request.args.get("date_to", "")
+def fts_available(conn):
+    global _fts_ready
+    if _fts_ready is None:
+        _fts_ready = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'reports_fts'"
+        ).fetchone() is not None
+    return _fts_ready
 
-    now = datetime.now()
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def split_search_terms(q):
+    """
+    แยกคำค้นเป็น (MATCH expression, คำที่ต้องใช้ LIKE)
+    trigram ต้องยาว ≥ 3 ตัวอักษร คำที่สั้นกว่านั้นส่งกลับไปใช้ LIKE
+    """
+    phrases = []
+    like_words = []
+    for w in q.split():
+        if len(w) >= 3:
+            phrases.append('"' + w.replace('"', '""') + '"')
+        else:
+            like_words.append(w)
+    return " AND ".join(phrases), like_words
+
+
+# ==================================================
+# cursor หน้า /list = (receive_at, id) ของแถวอ้างอิง
+# ==================================================
+def encode_list_cursor(row):
+    raw = f"{row['receive_at']}|{row['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_list_cursor(token):
+    if not token:
+        return None
+    try:
+        receive_at, report_id = (
+            base64.urlsafe_b64decode(token.encode("ascii"))
+            .decode("utf-8")
+            .split("|")
+        )
+        return receive_at, int(report_id)
+    except Exception:
+        return None
+
+
+# ==================================================
+# เงื่อนไขค้นหาหน้า /list
+# ==================================================
+def report_list_filter(conn, args, now):
+    """
+    เงื่อนไขค้นหาของหน้า /list (ใช้ร่วมกับ /list/export.csv)
+    คืน (source, source_params, where, params, order_by)
+    order_by = None → เรียงตาม (receive_at, id) ได้
+    """
+    q = args.get("q", "").strip()
+    job_type = args.get("job_type", "")
+    staff = args.get("staff")          # 👈 รับค่าจาก work_compare
+    date_from = args.get("date_from", "")
+    date_to = args.get("date_to", "")
+
+    source = "FROM reports"
+    source_params = []
+    order_by = None      # None = เรียงตาม (receive_at, id) → ใช้ cursor ได้
 
     where = "WHERE 1=1"
     params = []
 
     # ===== ค้นหาจากคำค้น =====
     if q:
-        for w in q.split():
+        if fts_available(conn):
+            match, like_words = split_search_terms(q)
+        else:
+            match, like_words = "", q.split()
+
+        # คำที่ยาวพอ → ดัชนี FTS เรียงตามความตรง (bm25) แล้วค่อยตามวันที่
+        if match:
+            source += """
+                JOIN (
+                    SELECT rowid AS fts_id, rank AS fts_rank
+                    FROM reports_fts
+                    WHERE reports_fts MATCH ?
+                ) AS fts ON fts.fts_id = reports.id
+            """
+            source_params.append(match)
+            order_by = "fts.fts_rank, receive_at DESC"
+
+        # คำสั้น (1-2 ตัวอักษร) trigram หาไม่ได้ → LIKE แบบเดิม
+        for w in like_words:
             where += """
                 AND (
                     work_no LIKE ?
@@ -761,29 +2136,52 @@ def list_reports():
         where += " AND confirm_name = ?"
         params.append(staff)
 
-    # ===== กรองช่วงวันที่ =====
+    # ===== กรองช่วงวันที่ (ไม่เลือก = เดือนปัจจุบัน) =====
     if date_from and date_to:
-        where += " AND receive_datetime >= ?"
-        params.append(f"{date_from} 00:00")
+        range_start, range_end = day_range(date_from, date_to)
+    else:
+        range_start, range_end = month_range(now.year, now.month)
 
-        where += " AND receive_datetime <= ?"
-        params.append(f"{date_to} 23:59")
+    where += " AND receive_at >= ? AND receive_at < ?"
+    params.extend([range_start, range_end])
 
-    else:
-        where += " AND receive_datetime IS NOT NULL AND receive_datetime != ''"
+    return source, source_params, where, params, order_by
+
+
+# ==================================================
+# รายการ
+# ==================================================
+@app.route("/list")
+def list_reports():
+    from datetime import datetime
+    import math
+
+    PER_PAGE = 15
+
+    page = request.args.get("page", 1, type=int)
+    q = request.args.get("q", "").strip()
+    job_type = request.args.get("job_type", "")
+    staff = request.args.get("staff")          # 👈 รับค่าจาก work_compare
+    date_from = request.args.get("date_from", "")
+    date_to = request.args.get("date_to", "")
+
+    now = datetime.now()
 
-        current_year = now.strftime("%Y")
-        current_month = now.strftime("%m")
+    conn = get_db()
+    cursor = conn.cursor()
 
-        where += " AND substr(receive_datetime, 1, 4) = ?"
-        params.append(current_year)
+    after = decode_list_cursor(request.args.get("after", ""))
+    before = decode_list_cursor(request.args.get("before", ""))
 
-        where += " AND substr(receive_datetime, 6, 2) = ?"
-        params.append(current_month)
+    source, source_params, where, params, order_by = report_list_filter(
+        conn, request.args, now
+    )
 
-    # ===== COUNT =====
-    cursor.execute(f"SELECT COUNT(*) FROM reports {where}", params)
-    total_rows = cursor.fetchone()[0]
+    # ===== COUNT (cache จนกว่า reports จะเปลี่ยน) =====
+    total_rows = cached_count(
+        conn, "reports",
+        f"SELECT COUNT(*) {source} {where}", source_params + params
+    )
     total_pages = math.ceil(total_rows / PER_PAGE) if total_rows else 1
 
     if page > total_pages:
@@ -791,11 +2189,7 @@ def list_reports():
     if page < 1:
         page = 1
 
-    offset = (page - 1) * PER_PAGE
-
-    # ===== SELECT =====
-    cursor.execute(f"""
-        SELECT
+    columns = """
             id,
             work_no,
             receive_datetime,
@@ -803,25 +2197,72 @@ def list_reports():
             job_type,
             problem,
             solution,
-            reporter
-        FROM reports
-        {where}
-        ORDER BY receive_datetime DESC
-        LIMIT ? OFFSET ?
-    """, params + [PER_PAGE, offset])
+            reporter,
+            receive_at
+    """
 
-    raw = cursor.fetchall()
-    conn.close()
+    # ===== SELECT =====
+    if order_by is None and (after or before):
+        # keyset: ต่อจากแถวสุดท้าย/แรกของหน้าก่อน ไม่ต้องข้ามแถวด้วย OFFSET
+        if after:
+            seek = " AND (receive_at, reports.id) < (?, ?)"
+            seek_order = "receive_at DESC, reports.id DESC"
+        else:
+            seek = " AND (receive_at, reports.id) > (?, ?)"
+            seek_order = "receive_at ASC, reports.id ASC"
+
+        cursor.execute(f"""
+            SELECT {columns}
+            {source}
+            {where}{seek}
+            ORDER BY {seek_order}
+            LIMIT ?
+        """, source_params + params + list(after or before) + [PER_PAGE + 1])
+
+        raw = cursor.fetchall()
+        has_more = len(raw) > PER_PAGE
+        raw = raw[:PER_PAGE]
+
+        if after:
+            has_next, has_prev = has_more, True
+        else:
+            raw.reverse()
+            has_next, has_prev = True, has_more
+    else:
+        offset = (page - 1) * PER_PAGE
+
+        cursor.execute(f"""
+            SELECT {columns}
+            {source}
+            {where}
+            ORDER BY {order_by or "receive_at DESC, reports.id DESC"}
+            LIMIT ? OFFSET ?
+        """, source_params + params + [PER_PAGE, offset])
+
+        raw = cursor.fetchall()
+        has_next, has_prev = page < total_pages, page > 1
+
+    # ===== cursor ของหน้าถัดไป / ก่อนหน้า =====
+    next_cursor = prev_cursor = ""
+    if order_by is None and raw:
+        if has_next:
+            next_cursor = encode_list_cursor(raw[-1])
+        if has_prev:
+            prev_cursor = encode_list_cursor(raw[0])
 
     reports = raw
 
     return render_template(
         "list.html",
         reports=reports,
-        get_department_full=get_department_full,
         format_date_th=format_date_th,
         page=page,
         total_pages=total_pages,
+        total_rows=total_rows,
+        has_next=has_next,
+        has_prev=has_prev,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
         keyword=q,
         job_type=job_type,
         date_from=date_from,
@@ -835,15 +2276,23 @@ def list_reports():
 # ==================================================
 @app.route("/report-summary", methods=["GET"])
 def report_summary():
-    conn = sqlite3.connect(DB_NAME)
+    import math
+
+    PER_PAGE = 50
+    JOB_TYPES = ["Software", "Hardware", "Network", "Other"]
+
+    conn = get_db()
     cursor = conn.cursor()
 
     date_from = request.args.get("date_from")
     date_to = request.args.get("date_to")
+    page = request.args.get("page", 1, type=int)
 
     is_search = False
     rows = []
     chart_data = {}
+    total_pages = 1
+    row_offset = 0
 
     total = software = hardware = network = other = 0
     date_from_th = date_to_th = ""
@@ -853,61 +2302,83 @@ def report_summary():
 
         date_from_th = format_date_th(date_from)
         date_to_th = format_date_th(date_to)
+        range_start, range_end = day_range(date_from, date_to)
 
-        # ===== ดึงข้อมูลตามช่วงวันที่ =====
+        # ===== ยอดรวม + กราฟ จาก GROUP BY ครั้งเดียว =====
+        # ประเภทที่ไม่รู้จัก → Other (เดิม KeyError)
         cursor.execute(
             """
             SELECT
-                receive_datetime,
                 department,
-                job_type,
-                problem,
-                solution,
-                reporter
+                CASE WHEN job_type IN ('Software', 'Hardware', 'Network')
+                     THEN job_type ELSE 'Other' END AS job_group,
+                COUNT(*) AS total,
+                MIN(receive_at) AS first_at
             FROM reports
-            WHERE date(receive_datetime)
-                  BETWEEN date(?) AND date(?)
-            ORDER BY receive_datetime ASC
+            WHERE receive_at >= ? AND receive_at < ?
+            GROUP BY department, job_group
         """,
-            (date_from, date_to),
+            (range_start, range_end),
         )
 
-        rows = cursor.fetchall()
-
-        # ===== นับประเภทงาน =====
-        for r in rows:
-            total += 1
-            if r[2] == "Software":
-                software += 1
-            elif r[2] == "Hardware":
-                hardware += 1
-            elif r[2] == "Network":
-                network += 1
-            else:
-                other += 1
-
-        # ===== เตรียมข้อมูลกราฟ =====
+        type_count = {t: 0 for t in JOB_TYPES}
         dept_count = {}
-        for r in rows:
-            dept = r[1]
-            dept_count.setdefault(
-                dept, {"Software": 0, "Hardware": 0, "Network": 0, "Other": 0}
+        dept_first = {}
+
+        for r in cursor.fetchall():
+            type_count[r["job_group"]] += r["total"]
+            dept_count.setdefault(r["department"], {t: 0 for t in JOB_TYPES})
+            dept_count[r["department"]][r["job_group"]] += r["total"]
+            dept_first[r["department"]] = min(
+                dept_first.get(r["department"], r["first_at"]), r["first_at"]
             )
-            dept_count[dept][r[2]] += 1
 
+        software = type_count["Software"]
+        hardware = type_count["Hardware"]
+        network = type_count["Network"]
+        other = type_count["Other"]
+        total = sum(type_count.values())
+
+        # ===== เตรียมข้อมูลกราฟ (หน่วยงานเรียงตามงานแรกในช่วง) =====
+        labels = sorted(dept_count, key=lambda d: dept_first[d])
         chart_data = {
-            "labels": list(dept_count.keys()),
-            "software": [v["Software"] for v in dept_count.values()],
-            "hardware": [v["Hardware"] for v in dept_count.values()],
-            "network": [v["Network"] for v in dept_count.values()],
-            "other": [v["Other"] for v in dept_count.values()],
+            "labels": labels,
+            "software": [dept_count[d]["Software"] for d in labels],
+            "hardware": [dept_count[d]["Hardware"] for d in labels],
+            "network": [dept_count[d]["Network"] for d in labels],
+            "other": [dept_count[d]["Other"] for d in labels],
         }
 
-    conn.close()
+        # ===== ตารางรายละเอียด ทีละหน้า =====
+        total_pages = math.ceil(total / PER_PAGE) if total else 1
+        page = min(max(page, 1), total_pages)
+        row_offset = (page - 1) * PER_PAGE
+
+        cursor.execute(
+            """
+            SELECT
+                receive_datetime,
+                department,
+                job_type,
+                problem,
+                solution,
+                reporter
+            FROM reports
+            WHERE receive_at >= ? AND receive_at < ?
+            ORDER BY receive_at ASC, id ASC
+            LIMIT ? OFFSET ?
+        """,
+            (range_start, range_end, PER_PAGE, row_offset),
+        )
+
+        rows = cursor.fetchall()
 
     return render_template(
         "report_summary.html",
         rows=rows,
+        page=page,
+        total_pages=total_pages,
+        row_offset=row_offset,
         total=total,
         software=software,
         hardware=hardware,
@@ -926,51 +2397,29 @@ from collections import defaultdict
 from datetime import datetime
 import calendar
 import sqlite3
-from flask import request, render_template
-
-@app.route("/report-monthly-summary")
-def report_monthly_summary():
-
-    # ===============================
-    # 1) รับค่าเดือน / ปี
-    # ===============================
-    month = request.args.get("month", type=int)
-    year = request.args.get("year", type=int)
+from flask import request, render_template, make_response
 
-    now = datetime.now()
-    current_year = now.year
-
-    if not month or not year:
-        month = now.month
-        year = now.year
-
-    last_day = calendar.monthrange(year, month)[1]
-    date_from = f"{year}-{month:02d}-01"
-    date_to = f"{year}-{month:02d}-{last_day}"
-
-    # ===============================
-    # 2) ดึงข้อมูลจาก DB
-    # ===============================
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+def monthly_summary_data(conn, year, month):
+    """
+    ตัวเลขของหน้าสรุปรายเดือน (การ์ด + ตาราง) จากตารางสรุป
+    ใช้ทั้งตอนแสดงหน้า และตอนปิดเดือน (render เก็บเป็น snapshot)
+    """
     cur = conn.cursor()
 
     cur.execute("""
         SELECT
             department,
             job_type,
-            COUNT(*) AS total
-        FROM reports
-        WHERE receive_datetime >= ?
-          AND receive_datetime <= ?
+            SUM(total) AS total
+        FROM report_monthly_rollup
+        WHERE year = ? AND month = ?
         GROUP BY department, job_type
-    """, (f"{date_from} 00:00", f"{date_to} 23:59"))
+    """, (year, month))
 
     rows = cur.fetchall()
-    conn.close()
 
     # ===============================
-    # 3) เตรียมโครงข้อมูล
+    # เตรียมโครงข้อมูล
     # ===============================
     types = ["Software", "Hardware", "Network", "Other"]
 
@@ -985,7 +2434,7 @@ def report_monthly_summary():
     }
 
     # ===============================
-    # 4) ใส่ข้อมูลลง summary
+    # ใส่ข้อมูลลง summary
     # ===============================
     for r in rows:
         dept = (r["department"] or "ไม่ระบุ").strip()
@@ -1001,20 +2450,232 @@ def report_monthly_summary():
         grand_total["items"][t] += count
         grand_total["total"] += count
 
+    return {"types": types, "summary": summary, "grand_total": grand_total}
+
+
+@app.route("/report-monthly-summary")
+def report_monthly_summary():
+
     # ===============================
-    # 5) ส่งให้ template
+    # 1) รับค่าเดือน / ปี
     # ===============================
-    return render_template(
+    month = request.args.get("month", type=int)
+    year = request.args.get("year", type=int)
+
+    now = datetime.now()
+    current_year = now.year
+
+    if not month or not year:
+        month = now.month
+        year = now.year
+
+    last_day = calendar.monthrange(year, month)[1]
+    date_from = f"{year}-{month:02d}-01"
+    date_to = f"{year}-{month:02d}-{last_day}"
+
+    # ===============================
+    # 2) เดือนที่ปิดแล้ว → ใช้ HTML ที่ render เก็บไว้ / ยังไม่ปิด → คำนวณ
+    # ===============================
+    conn = get_db()
+    closed_at = month_closed_at(conn, year, month)
+    etag = month_snapshot_etag(conn, year, month, "summary")
+
+    if etag:
+        data = {"summary_html": snapshot_row(conn, etag)["content"].decode("utf-8")}
+    else:
+        data = monthly_summary_data(conn, year, month)
+
+    # ===============================
+    # 3) ส่งให้ template
+    # ===============================
+    response = make_response(render_template(
         "report_monthly_summary.html",
         date_from=date_from,
         date_to=date_to,
-        types=types,
-        summary=summary,
-        grand_total=grand_total,
         selected_month=month,
         selected_year=year,
-        current_year=current_year
+        current_year=current_year,
+        can_close=(year, month) < (now.year, now.month),
+        closed_at=closed_at,
+        **data
+    ))
+
+    # หน้าเดือนที่ปิดแล้วเปลี่ยนเฉพาะตอนปิดใหม่ / ขึ้นปีใหม่ → ให้ browser ถามด้วย ETag
+    if etag:
+        response.set_etag(f"{etag}-{current_year}")
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+    return response
+
+
+# ==================================================
+# ปิดเดือน (เก็บหน้าสรุป + ไฟล์ export ของเดือนนั้นไว้ถาวร)
+# ==================================================
+from werkzeug.datastructures import MultiDict
+import hashlib
+import io
+
+XLSX_MIMETYPE = (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+)
+SNAPSHOT_MAX_AGE = 365 * 24 * 3600      # URL ผูกกับ hash ของไฟล์ → cache ได้ไม่มีวันหมดอายุ
+
+
+def month_period(year, month):
+    return f"{year}-{month:02d}"
+
+
+def month_closed_at(conn, year, month):
+    row = conn.execute(
+        "SELECT closed_at FROM closed_months WHERE period = ?",
+        (month_period(year, month),),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def month_snapshot_etag(conn, year, month, kind, name=""):
+    # เดือนถูกเปิดใหม่ (มีคนแก้ข้อมูล) → trigger ลบ snapshot ไปแล้ว → None
+    row = conn.execute("""
+        SELECT etag FROM month_snapshots
+        WHERE period = ? AND kind = ? AND name = ?
+    """, (month_period(year, month), kind, name)).fetchone()
+    return row[0] if row else None
+
+
+def snapshot_row(conn, etag):
+    return conn.execute("""
+        SELECT filename, mimetype, content FROM month_snapshots
+        WHERE etag = ?
+        LIMIT 1
+    """, (etag,)).fetchone()
+
+
+# ===== export ไหนตรงกับ snapshot ตัวไหน (ไม่ตรง → None = สร้างตามปกติ) =====
+def report_snapshot_key(args):
+    months = whole_months(args.get("date_from", ""), args.get("date_to", ""))
+    if months and months[0] == months[1]:
+        return (*months[0], "report", "")
+    return None
+
+
+def monthly_snapshot_key(args):
+    month = args.get("month", type=int)
+    year = args.get("year", type=int)
+    if month and year and not args.get("department"):
+        return year, month, "monthly", ""
+    return None
+
+
+def attendance_snapshot_key(args):
+    staff_name = args.get("staff_name")
+    if not staff_name:
+        return None
+    return (*attendance_export_period(args), "attendance", staff_name)
+
+
+def _export_snapshot(build, values):
+    path, filename = build(MultiDict(values))
+    with open(path, "rb") as f:
+        return filename, XLSX_MIMETYPE, f.read()
+
+
+def close_month(conn, year, month):
+    """
+    ปิดเดือน: render หน้าสรุป + ไฟล์ export ทุกตัวของเดือนนั้น เก็บลง month_snapshots
+    - สร้างไฟล์นอก transaction (อาจนานหลายวินาที ไม่ถือ lock เขียนไว้)
+    - ตอนบันทึกเช็ก version ของตารางอีกรอบ มีคนแก้ข้อมูลระหว่างนั้น → คืน False ไม่ปิด
+    ปิดซ้ำ = สร้าง snapshot ใหม่ทั้งชุด (เช่น หลังเปลี่ยนรูปลายเซ็น)
+    """
+    versions = {t: table_version(conn, t) for t in ("reports", "attendance")}
+
+    last_day = calendar.monthrange(year, month)[1]
+    date_from = f"{year}-{month:02d}-01"
+    date_to = f"{year}-{month:02d}-{last_day}"
+
+    summary_html = render_template(
+        "report_monthly_summary_table.html",
+        **monthly_summary_data(conn, year, month)
+    )
+    snapshots = [
+        ("summary", "", None, "text/html; charset=utf-8", summary_html.encode("utf-8")),
+        ("report", "", *_export_snapshot(
+            build_report_export, {"date_from": date_from, "date_to": date_to})),
+        ("monthly", "", *_export_snapshot(
+            build_monthly_summary_export, {"month": month, "year": year})),
+    ]
+
+    staff_names = [
+        r[0] for r in conn.execute("""
+            SELECT DISTINCT staff_name
+            FROM attendance
+            WHERE work_date BETWEEN ? AND ?
+            ORDER BY staff_name
+        """, (date_from, date_to))
+    ]
+    for name in staff_names:
+        snapshots.append(("attendance", name, *_export_snapshot(
+            build_attendance_export,
+            {"staff_name": name, "month": month, "year": year},
+        )))
+
+    period = month_period(year, month)
+    with write_tx(conn):
+        if any(table_version(conn, t) != v for t, v in versions.items()):
+            return False
+
+        # ลบของเดิม (trigger ลบ snapshot ชุดเก่าให้) แล้วปิดใหม่
+        conn.execute("DELETE FROM closed_months WHERE period = ?", (period,))
+        conn.execute(
+            "INSERT INTO closed_months (period, closed_at) VALUES (?, ?)",
+            (period, datetime.now().strftime(TS_FORMAT)),
+        )
+        conn.executemany("""
+            INSERT INTO month_snapshots
+                (period, kind, name, etag, filename, mimetype, content)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (period, kind, name, hashlib.sha256(content).hexdigest()[:32],
+             filename, mimetype, content)
+            for kind, name, filename, mimetype, content in snapshots
+        ])
+    return True
+
+
+@app.route("/report-monthly-summary/close", methods=["POST"])
+def close_month_route():
+    month = request.form.get("month", type=int)
+    year = request.form.get("year", type=int)
+    now = datetime.now()
+
+    if not month or not year or not 1 <= month <= 12:
+        return "กรุณาเลือกเดือนและปี", 400
+    if (year, month) >= (now.year, now.month):
+        return "ปิดได้เฉพาะเดือนที่ผ่านไปแล้ว", 400
+
+    if not close_month(get_db(), year, month):
+        return "มีการแก้ไขข้อมูลของเดือนนี้ระหว่างปิดเดือน กรุณาลองใหม่", 409
+
+    return redirect(url_for("report_monthly_summary", month=month, year=year))
+
+
+@app.route("/snapshots/<etag>")
+def snapshot_file(etag):
+    row = snapshot_row(get_db(), etag)
+    if row is None:
+        return "ไม่พบไฟล์ (เดือนนี้ถูกเปิดใหม่แล้ว)", 404
+
+    # เนื้อหาไม่มีวันเปลี่ยน (เปลี่ยน = hash ใหม่ = URL ใหม่)
+    response = send_file(
+        io.BytesIO(row["content"]),
+        mimetype=row["mimetype"],
+        as_attachment=row["filename"] is not None,
+        download_name=row["filename"],
+        etag=etag,
+        conditional=True,
+        max_age=SNAPSHOT_MAX_AGE,
     )
+    response.cache_control.immutable = True
+    return response
 
 
 
@@ -1073,21 +2734,415 @@ def format_time_th(date_str):
     return dt.strftime("%H.%M น.")
 
 
+# ===== ขากลับ: วันที่ / เวลาแบบไทย (พ.ศ.) → ISO =====
+from datetime import date, time as dt_time
+
+TH_MONTHS_SHORT = [
+    "", "ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.",
+    "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค.",
+]
+# ชื่อเดือนเต็ม / ย่อ (ตัดจุดออก: "ม.ค." = "มค") → เลขเดือน
+TH_MONTH_NUMBER = {
+    name.replace(".", ""): i
+    for names in (TH_MONTHS, TH_MONTHS_SHORT)
+    for i, name in enumerate(names) if name
+}
+TH_DATE_TEXT = re.compile(r"(\d{1,2})\s*([^\d\s/\-]+)\s*(\d{2,4})")
+TH_DATE_NUMERIC = re.compile(r"(\d{1,4})[/\-](\d{1,2})[/\-](\d{1,4})")
+TH_TIME = re.compile(r"(\d{1,2})\s*[.:]\s*(\d{2})")
+
+
+def buddhist_year(year):
+    # 68 → 2568 / พ.ศ. → ค.ศ. (ปีที่เป็น ค.ศ. อยู่แล้วไม่แตะ)
+    if year < 100:
+        year += 2500
+    return year - 543 if year > 2400 else year
+
+
+def parse_date_th(value):
+    """
+    กลับด้านของ format_date_full_th → "YYYY-MM-DD" (อ่านไม่ได้ → None)
+    รองรับ: "1 ธันวาคม 2568" / "1 ธ.ค. 68" / "01/12/2568" / "2025-12-01" / ช่องวันที่ของ Excel
+    """
+    if isinstance(value, (datetime, date)):
+        try:
+            return date(buddhist_year(value.year), value.month, value.day).isoformat()
+        except ValueError:
+            return None
+
+    text = unicodedata.normalize("NFKC", str(value or "")).translate(THAI_DIGITS).strip()
+
+    m = TH_DATE_TEXT.search(text)
+    if m and m.group(2).replace(".", "") in TH_MONTH_NUMBER:
+        day, month, year = int(m.group(1)), TH_MONTH_NUMBER[m.group(2).replace(".", "")], int(m.group(3))
+    else:
+        m = TH_DATE_NUMERIC.search(text)
+        if not m:
+            return None
+        a, month, b = (int(x) for x in m.groups())
+        # ปีขึ้นก่อน = ISO (YYYY-MM-DD) / นอกนั้น = วัน/เดือน/ปี
+        day, year = (b, a) if len(m.group(1)) == 4 else (a, b)
+
+    try:
+        return date(buddhist_year(year), month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def parse_time_th(value):
+    """
+    กลับด้านของ format_time_th → "HH:MM" / ไม่มีเวลา ("-", ว่าง) → "00:00" / อ่านไม่ได้ → None
+    """
+    if isinstance(value, (datetime, dt_time)):
+        return value.strftime("%H:%M")
+
+    text = unicodedata.normalize("NFKC", str(value or "")).translate(THAI_DIGITS).strip()
+    if text.lower() in IMPORT_BLANKS or not text:
+        return "00:00"
+
+    m = TH_TIME.search(text)
+    if not m or int(m.group(1)) > 23 or int(m.group(2)) > 59:
+        return None
+    return f"{int(m.group(1)):02d}:{m.group(2)}"
+
+
+# ==================================================
+# cache ไฟล์ export (reports/cache/)
+# ==================================================
+import hashlib
+import json
+import time
+
+# โฟลเดอร์ของ cache เอง → ไฟล์อื่นใน reports/ (ไฟล์รายงานเก่า) ไม่โดนล้าง
+EXPORT_CACHE_DIR = os.path.join("reports", "cache")
+# ชื่อไฟล์ที่ export_cache_path / save_export สร้าง ({kind}_{hash}.xlsx / ....tmp)
+EXPORT_CACHE_NAME = re.compile(r"[a-z_]+_[0-9a-f]{24}\.xlsx(\.[0-9a-f]{32}\.tmp)?")
+EXPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024     # 200 MB
+EXPORT_CACHE_MAX_AGE = 7 * 24 * 3600           # 7 วัน
+
+
+def export_cache_path(conn, kind, params, tables):
+    """
+    ชื่อไฟล์ = hash ของ (ชนิด export, พารามิเตอร์, version ของตารางที่ใช้)
+    ข้อมูลเปลี่ยน → version เปลี่ยน → ได้ชื่อไฟล์ใหม่เอง ไม่ต้องสั่งล้าง
+    """
+    versions = {t: table_version(conn, t) for t in tables}
+    raw = json.dumps([kind, params, versions], sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(EXPORT_CACHE_DIR, f"{kind}_{digest}.xlsx")
+
+
+def save_export(wb, path):
+    # serialize ครั้งเดียว ลงไฟล์ชั่วคราวก่อนแล้วค่อยแทนที่ → ไม่มีใครได้ไฟล์ครึ่ง ๆ กลาง ๆ
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    write_workbook(wb, tmp_path)
+    os.replace(tmp_path, path)
+    evict_export_cache()
+
+
+def send_export(path, download_name):
+    # แตะ mtime = ใช้ล่าสุด (LRU)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    # send_file ตีความ path relative จากโฟลเดอร์ app ไม่ใช่ cwd → ส่ง path เต็ม
+    return send_file(
+        os.path.abspath(path), as_attachment=True, download_name=download_name
+    )
+
+
+class ExportError(Exception):
+    """พารามิเตอร์ export ไม่ครบ / ไม่ถูกต้อง (ตอบกลับ 400)"""
+
+
+def no_progress(done, total):
+    pass
+
+
+def respond_export(build, args, snapshot=None):
+    # route export ทุกตัว: สร้าง (หรือใช้ไฟล์ใน cache) แล้วส่งไฟล์ทันที
+    # เดือนที่ปิดแล้ว → ส่งต่อไปไฟล์ snapshot (URL ถาวร browser cache ได้)
+    if snapshot:
+        key = snapshot(args)
+        etag = key and month_snapshot_etag(get_db(), *key)
+        if etag:
+            return redirect(url_for("snapshot_file", etag=etag))
+
+    try:
+        path, filename = build(args)
+    except ExportError as e:
+        return str(e), 400
+    return send_export(path, filename)
+
+
+def evict_export_cache():
+    """
+    ลบไฟล์ cache ที่เก่าเกิน EXPORT_CACHE_MAX_AGE
+    แล้วลบไฟล์ที่ไม่ได้ใช้นานสุดจนขนาดรวมไม่เกิน EXPORT_CACHE_MAX_BYTES
+    แตะเฉพาะชื่อไฟล์ตามรูปแบบของ cache (EXPORT_CACHE_NAME) ไฟล์อื่นไม่ลบ
+    """
+    if not os.path.isdir(EXPORT_CACHE_DIR):
+        return
+    now = time.time()
+    files = []
+
+    for entry in os.scandir(EXPORT_CACHE_DIR):
+        if not entry.is_file() or not EXPORT_CACHE_NAME.fullmatch(entry.name):
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+
+        is_tmp = entry.name.endswith(".tmp")
+        # ไฟล์ .tmp ที่ค้างเกิน 1 ชม. = เขียนไม่จบ
+        max_age = 3600 if is_tmp else EXPORT_CACHE_MAX_AGE
+        if now - st.st_mtime > max_age:
+            _remove_quietly(entry.path)
+        elif entry.name.endswith(".xlsx"):
+            files.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= EXPORT_CACHE_MAX_BYTES:
+            break
+        _remove_quietly(path)
+        total -= size
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ==================================================
+# รูปใน Excel (โลโก้ / ลายเซ็น)
+# ==================================================
+from collections import OrderedDict
+from zipfile import ZipFile, ZIP_DEFLATED
+from PIL import Image as PILImage
+from openpyxl.writer.excel import ExcelWriter
+
+IMAGE_CACHE_SIZE = 64
+_image_cache = OrderedDict()     # (path, mtime, กว้าง, สูง) → PNG bytes
+_image_cache_lock = threading.Lock()
+
+
+def resized_png(path, width, height):
+    """
+    PNG ที่ย่อเป็นขนาดที่ใช้ในชีตแล้ว (ถอดรหัส/ย่อครั้งเดียวต่อไฟล์)
+    แก้ไฟล์ → mtime เปลี่ยน → key ใหม่ / ของเก่าหลุดจาก LRU เอง
+    """
+    key = (path, os.path.getmtime(path), width, height)
+
+    with _image_cache_lock:
+        data = _image_cache.get(key)
+        if data is not None:
+            _image_cache.move_to_end(key)
+            return data
+
+    with PILImage.open(path) as img:
+        img = img.convert("RGBA").resize((width, height), PILImage.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="PNG", optimize=True)
+        data = out.getvalue()
+
+    with _image_cache_lock:
+        _image_cache[key] = data
+        while len(_image_cache) > IMAGE_CACHE_SIZE:
+            _image_cache.popitem(last=False)
+
+    return data
+
+
+class SharedImage(XLImage):
+    """
+    รูปที่วางได้หลายช่องแต่เก็บใน xlsx ไฟล์เดียว
+    ทุกตัวที่สร้างจาก part เดียวกันชี้ไปที่ xl/media/imageN.png ไฟล์เดียวกัน
+    """
+
+    def __init__(self, part, width, height):
+        # ไม่เรียก XLImage.__init__ → ไม่ต้องเปิดไฟล์รูปใหม่ทุกครั้ง
+        self.ref = None
+        self.format = "png"
+        self.width = width
+        self.height = height
+        self._part = part
+
+    @property
+    def _id(self):
+        return self._part["id"]
+
+    @_id.setter
+    def _id(self, value):
+        # ExcelWriter ไล่ใส่เลขให้ทุกรูป → ใช้เลขของตัวแรกเป็นชื่อไฟล์ร่วม
+        if self._part["id"] is None:
+            self._part["id"] = value
+
+    def _data(self):
+        return self._part["data"]
+
+
+def workbook_image(parts, path, width, height):
+    """
+    รูปสำหรับวางในชีต 1 ช่อง
+    parts = dict ของ workbook นั้น (ห้ามใช้ข้าม workbook)
+    """
+    if not SHARED_IMAGES:
+        img = XLImage(io.BytesIO(resized_png(path, width, height)))
+        img.width, img.height = width, height
+        return img
+
+    key = (path, width, height)
+    part = parts.get(key)
+    if part is None:
+        part = parts[key] = {"data": resized_png(path, width, height), "id": None}
+    return SharedImage(part, width, height)
+
+
+# SharedImage / SharedImageWriter อิง API ภายในของ openpyxl (ทดสอบกับ 3.1.x ดู requirements.txt)
+# openpyxl รุ่นที่ไม่มี hook เหล่านี้ → ใช้รูปแยกไฟล์ + wb.save() ตามปกติ (ไฟล์ใหญ่ขึ้นแต่ถูกต้อง)
+SHARED_IMAGES = all(
+    hasattr(cls, name)
+    for cls, name in (
+        (ExcelWriter, "_write_images"),
+        (ExcelWriter, "save"),
+        (XLImage, "_data"),
+        (XLImage, "path"),
+    )
+)
+
+
+class SharedImageWriter(ExcelWriter):
+    # รูปที่ path ซ้ำกัน (SharedImage) → เขียนลงไฟล์ครั้งเดียว
+    def _write_images(self):
+        written = set()
+        for img in self._images:
+            if img.path in written:
+                continue
+            written.add(img.path)
+            self._archive.writestr(img.path[1:], img._data())
+
+
+def write_workbook(wb, filename):
+    # เหมือน wb.save() แต่ใช้ SharedImageWriter
+    if not SHARED_IMAGES:
+        wb.save(filename)
+        return
+    if wb.write_only and not wb.worksheets:
+        wb.create_sheet()
+    wb.properties.modified = datetime.now(ZoneInfo("UTC")).replace(tzinfo=None)
+    archive = ZipFile(filename, "w", ZIP_DEFLATED, allowZip64=True)
+    SharedImageWriter(wb, archive).save()
+
+
+REPORT_EXPORT = {
+    "sheet": "รายงานแจ้งปัญหา",
+    "page": {"row_height": 28},
+    "styles": {
+        "report_header": dict(
+            font=Font(bold=True),
+            fill=PatternFill("solid", fgColor="E7EDF8"),
+            alignment=CENTER_WRAP,
+            border=BOX,
+        ),
+        "report_body": dict(alignment=CENTER_WRAP, border=BOX),
+    },
+    "header": {"style": "report_header"},
+    "body": {"style": "report_body"},
+    "columns": [
+        export_column("ลำดับ", value=ROW_NO),
+        export_column("วันที่", value=lambda r: format_date_full_th(r["receive_at"])),
+        export_column("เวลา", value=lambda r: format_time_th(r["receive_at"])),
+        export_column("เลขครุภัณฑ์", value=lambda r: r["asset_no"] or ""),
+        export_column("หน่วยงาน", value="department"),
+        export_column("ผู้แจ้ง", value="reporter"),
+        export_column("ประเภทงาน", value="job_type"),
+        export_column("ปัญหา", value="problem"),
+        export_column("วิธีแก้ไข", value="solution"),
+    ],
+}
+
+
+def report_export_widths(conn, range_start, range_end):
+    """
+    ความกว้างคอลัมน์ = ข้อความยาวสุด + 4 (ปัญหา / วิธีแก้ไข = 40 ตายตัว)
+    write-only ต้องรู้ความกว้างก่อนเขียนแถวแรก
+    → คิดจาก aggregate ครั้งเดียว (1 แถวต่อเดือน) ไม่ต้องวนข้อมูลใน Python
+    """
+    lengths = [len(c["header"]) for c in REPORT_EXPORT["columns"]]
+
+    rows = conn.execute(
+        """
+        SELECT
+            CAST(substr(receive_at, 6, 2) AS INTEGER) AS month,
+            COUNT(*) AS n,
+            MAX(CAST(substr(receive_at, 9, 2) AS INTEGER)) AS max_day,
+            MAX(length(asset_no)),
+            MAX(length(department)),
+            MAX(length(reporter)),
+            MAX(length(job_type))
+        FROM reports
+        WHERE receive_at >= ? AND receive_at < ?
+        GROUP BY month
+    """,
+        (range_start, range_end),
+    ).fetchall()
+
+    total = sum(r["n"] for r in rows)
+    if total:
+        lengths[0] = max(lengths[0], len(str(total)))
+        lengths[2] = max(lengths[2], len("00.00 น."))
+
+    for r in rows:
+        # "12 ธันวาคม 2568"
+        date_len = len(str(r["max_day"])) + 1 + len(TH_MONTHS[r["month"]]) + 5
+        lengths[1] = max(lengths[1], date_len)
+        for col, value in zip((3, 4, 5, 6), tuple(r)[3:]):
+            lengths[col] = max(lengths[col], value or 0)
+
+    widths = [n + 4 for n in lengths]
+    widths[7] = widths[8] = 40
+    return widths
+
+
 @app.route("/export-excel", methods=["GET"])
 def export_excel():
-    date_from = request.args.get("date_from")
-    date_to = request.args.get("date_to")
+    return respond_export(build_report_export, request.args, report_snapshot_key)
+
+
+def build_report_export(args, progress=None):
+    date_from = args.get("date_from")
+    date_to = args.get("date_to")
+
+    if not date_from or not date_to:
+        raise ExportError("กรุณาเลือกช่วงวันที่ก่อน Export")
+
+    conn = get_db()
+    range_start, range_end = day_range(date_from, date_to)
+    filename = f"report_{date_from}_to_{date_to}.xlsx"
 
-    if not date_from or not date_to:
-        return "กรุณาเลือกช่วงวันที่ก่อน Export", 400
+    # ===== เคย export ช่วงนี้แล้ว และข้อมูลยังไม่เปลี่ยน → ส่งไฟล์เดิม =====
+    path = export_cache_path(
+        conn, "report", {"from": range_start, "to": range_end}, ["reports"]
+    )
+    if os.path.exists(path):
+        return path, filename
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    total = conn.execute(
+        "SELECT COUNT(*) FROM reports WHERE receive_at >= ? AND receive_at < ?",
+        (range_start, range_end),
+    ).fetchone()[0]
 
-    cursor.execute(
+    # Data (วนจาก cursor ตรง ๆ ไม่ fetchall)
+    cursor = conn.execute(
         """
         SELECT
-            receive_datetime,
+            receive_at,
             asset_no,
             department,
             reporter,
@@ -1095,100 +3150,332 @@ def export_excel():
             problem,
             solution
         FROM reports
-        WHERE date(receive_datetime)
-              BETWEEN date(?) AND date(?)
-        ORDER BY receive_datetime ASC
+        WHERE receive_at >= ? AND receive_at < ?
+        ORDER BY receive_at ASC, id ASC
     """,
-        (date_from, date_to),
+        (range_start, range_end),
     )
 
-    rows = cursor.fetchall()
-    conn.close()
+    write_export(
+        REPORT_EXPORT, path, cursor,
+        widths=report_export_widths(conn, range_start, range_end),
+        progress=progress, total=total,
+    )
+    return path, filename
+
 
-    # ===== Excel =====
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "รายงานแจ้งปัญหา"
-
-    headers = [
-        "ลำดับ",
-        "วันที่",
-        "เวลา",
-        "เลขครุภัณฑ์",
-        "หน่วยงาน",
-        "ผู้แจ้ง",
-        "ประเภทงาน",
-        "ปัญหา",
-        "วิธีแก้ไข",
+# ==================================================
+# นำเข้างานย้อนหลัง จากไฟล์ Excel รูปแบบเดียวกับ export_excel
+# ==================================================
+from flask import jsonify
+import glob
+
+# คีย์ ← หัวคอลัมน์ (ลำดับคอลัมน์ในไฟล์สลับได้ / ลำดับที่ ไม่ใช้)
+BACKFILL_COLUMNS = [
+    ("date", "วันที่"),
+    ("time", "เวลา"),
+    ("asset_no", "เลขครุภัณฑ์"),
+    ("department", "หน่วยงาน"),
+    ("reporter", "ผู้แจ้ง"),
+    ("job_type", "ประเภทงาน"),
+    ("problem", "ปัญหา"),
+    ("solution", "วิธีแก้ไข"),
+]
+BACKFILL_FIELDS = ["asset_no", "department", "reporter", "job_type", "problem", "solution"]
+# คอลัมน์ไม่บังคับ: ไฟล์ที่มีเลขงานเดิม → ใช้เลขนั้น + ใช้เช็กซ้ำ
+BACKFILL_WORK_NO = "เลขงาน"
+BACKFILL_HEADER_SCAN = 10        # หาแถวหัวตารางใน 10 แถวแรก (ไฟล์เก่าบางไฟล์มีชื่อรายงานอยู่ด้านบน)
+BACKFILL_BATCH = 5000
+# โฟลเดอร์ไฟล์งานย้อนหลังที่รอนำเข้า (วางไฟล์เองเท่านั้น)
+# ไม่ใช้ reports/ เพราะมีไฟล์ที่ export จากฐานข้อมูลนี้เอง (สำเนาเก่าของงานที่มีอยู่แล้ว)
+REPORT_HISTORY_DIR = "history"
+
+
+def backfill_sources():
+    # ทุกไฟล์ .xlsx ใน history/ (รวมโฟลเดอร์ย่อย เช่น history/2566/) ยกเว้นไฟล์ lock ของ Excel
+    return [
+        p for p in sorted(glob.glob(os.path.join(REPORT_HISTORY_DIR, "**", "*.xlsx"), recursive=True))
+        if not os.path.basename(p).startswith("~$")
     ]
 
-    header_font = Font(bold=True)
-    header_fill = PatternFill("solid", fgColor="E7EDF8")
-    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    border = Border(
-        left=Side(style="thin"),
-        right=Side(style="thin"),
-        top=Side(style="thin"),
-        bottom=Side(style="thin"),
-    )
 
-    # Header
-    ws.append(headers)
-    for col in range(1, len(headers) + 1):
-        cell = ws.cell(row=1, column=col)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = center
-        cell.border = border
-
-    # Data
-    for idx, r in enumerate(rows, start=1):
-        ws.append(
-            [
-                idx,
-                format_date_full_th(r[0]),
-                format_time_th(r[0]),
-                r[1] or "",
-                r[2],
-                r[3],
-                r[4],
-                r[5],
-                r[6],
-            ]
+def read_report_sheet(source):
+    """
+    อ่านไฟล์รายงานแจ้งปัญหารอบเดียว (openpyxl read-only)
+    คืน generator ของ (เลขแถวใน Excel, ค่าเรียงตาม BACKFILL_COLUMNS + เลขงาน) / แถวว่างทั้งแถว → ข้าม
+    ไม่มีคอลัมน์เลขงาน → เลขงาน = ""
+    """
+    try:
+        wb = load_workbook(source, read_only=True, data_only=True)
+    except (InvalidFileException, BadZipFile):
+        raise ImportFileError("ไฟล์ต้องเป็น Excel (.xlsx) เท่านั้น")
+    rows = wb.active.iter_rows(values_only=True)
+
+    labels = [label for _, label in BACKFILL_COLUMNS]
+    for header_no, header in enumerate(itertools.islice(rows, BACKFILL_HEADER_SCAN), start=1):
+        index = {import_cell_text(h): i for i, h in enumerate(header)}
+        if all(label in index for label in labels):
+            break
+    else:
+        wb.close()
+        raise ImportFileError(
+            "ไม่ใช่ไฟล์รายงานแจ้งปัญหา (ไม่พบหัวตาราง: " + ", ".join(labels) + ")"
         )
 
-    # Style ทุกช่อง
-    for row in ws.iter_rows():
-        for cell in row:
-            cell.alignment = center
-            cell.border = border
+    picks = [index[label] for label in labels] + [index.get(BACKFILL_WORK_NO)]
 
-    # Row height เท่ากัน
-    for r in range(1, ws.max_row + 1):
-        ws.row_dimensions[r].height = 28
+    def records():
+        try:
+            for row_no, row in enumerate(rows, start=header_no + 1):
+                # วันที่ / เวลาเก็บค่าดิบไว้ (อาจเป็นช่องวันที่ของ Excel) ที่เหลือเป็นข้อความ
+                values = [row[i] if i < len(row) else None for i in picks[:2]] + [
+                    import_cell_text(row[i]) if i is not None and i < len(row) else ""
+                    for i in picks[2:]
+                ]
+                if any(import_cell_text(v) for v in values):
+                    yield row_no, values
+        finally:
+            wb.close()
 
-    # Auto column width
-    for col in ws.columns:
-        max_length = 0
-        col_letter = col[0].column_letter
+    return records()
 
-        for cell in col:
-            if cell.value:
-                max_length = max(max_length, len(str(cell.value)))
 
-        if col_letter in ["H", "I"]:
-            ws.column_dimensions[col_letter].width = 40
+def _parse_report_workbook(source):
+    """
+    รันใน process ลูก: ไฟล์ (path / bytes) → (แถวที่แปลงแล้ว, แถวที่ข้าม)
+    แถว = (receive_datetime "YYYY-MM-DD HH:MM", *BACKFILL_FIELDS, เลขงาน)
+    วันที่ / เวลาอ่านไม่ได้ → ข้ามแถวนั้น (รายงานกลับ) แต่แถวอื่นในไฟล์ยังนำเข้าต่อ
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    rows, skipped = [], []
+    for row_no, (raw_date, raw_time, *fields) in read_report_sheet(source):
+        day = parse_date_th(raw_date)
+        clock = parse_time_th(raw_time)
+        if not day or not clock:
+            shown = import_cell_text(raw_date if not day else raw_time) or "-"
+            skipped.append((row_no, shown, "วันที่ / เวลาไม่ถูกต้อง"))
+            continue
+        *fields, work_no = fields
+        # Excel เก็บเลขงานเป็นตัวเลข → เลขศูนย์นำหน้าหาย (0010126 → 10126)
+        if work_no.isdigit():
+            work_no = work_no.zfill(7)
+        rows.append((f"{day} {clock}", *fields, work_no))
+    return rows, skipped
+
+
+def parse_report_workbooks(workbooks):
+    """
+    อ่านหลายไฟล์พร้อมกันใน process pool → yield (ชื่อไฟล์, แถว, แถวที่ข้าม, error) ตามลำดับที่เสร็จ
+    workbooks = [(ชื่อไฟล์, path หรือ bytes)]
+    """
+    if len(workbooks) == 1:
+        name, source = workbooks[0]
+        try:
+            yield (name, *_parse_report_workbook(source), None)
+        except ImportFileError as e:
+            yield name, [], [], str(e)
+        return
+
+    pool = process_pool()
+    futures = {
+        pool.submit(_parse_report_workbook, source): name
+        for name, source in workbooks
+    }
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            rows, skipped = future.result()
+        except ImportFileError as e:
+            yield name, [], [], str(e)
+        except BrokenProcessPool:
+            app.logger.exception("อ่านไฟล์งานย้อนหลัง %s ไม่สำเร็จ", name)
+            _discard_process_pool(pool)
+            yield name, [], [], "อ่านไฟล์ไม่สำเร็จ"
+        except Exception:
+            app.logger.exception("อ่านไฟล์งานย้อนหลัง %s ไม่สำเร็จ", name)
+            yield name, [], [], "อ่านไฟล์ไม่สำเร็จ"
         else:
-            ws.column_dimensions[col_letter].width = max_length + 4
+            yield name, rows, skipped, None
+
 
-        filename = f"report_{date_from}_to_{date_to}.xlsx"
-        os.makedirs("reports", exist_ok=True)
-        filepath = os.path.join("reports", filename)
+def backfill_reports(conn, rows):
+    """
+    เพิ่มงานย้อนหลังทั้งไฟล์ใน transaction เดียว → คืน (เพิ่มจริง, ซ้ำ)
+    1. โหลดลง temp.report_backfill ทีละ BACKFILL_BATCH แถว (executemany)
+    2. ตัดแถวที่มีในฐานข้อมูลแล้ว
+       - มีเลขงาน → เลขงานนี้มีอยู่แล้ว (หรือซ้ำกับแถวก่อนหน้าในไฟล์)
+       - ทุกแถว → นาทีเดียวกัน + หน่วยงาน + ผู้แจ้ง + ปัญหา เหมือนกัน
+       → ไฟล์ช่วงวันที่ทับกัน / รันซ้ำ ไม่เพิ่มซ้ำ
+       (แถวไม่มีเลขงานที่เหมือนกันในไฟล์เดียวกัน = คนละงาน เพิ่มครบทุกแถว)
+    3. แถวที่มีเลขงาน → ใช้เลขเดิม (ขยับ work_no_seq ให้เกินเลขนั้นก่อน)
+       แถวที่ไม่มี → จองเลขทีละเดือน (work_no_seq +n ครั้งเดียวต่อเดือน)
+       แล้ว INSERT ... SELECT รอบเดียว
+    """
+    conn.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS report_backfill (
+            id INTEGER PRIMARY KEY,
+            period TEXT,
+            receive_datetime TEXT,
+            {", ".join(f"{c} TEXT" for c in BACKFILL_FIELDS)},
+            work_no TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS report_backfill_seq (
+            period TEXT PRIMARY KEY,
+            start INTEGER
+        )
+    """)
+
+    columns = ["period", "receive_datetime"] + BACKFILL_FIELDS + ["work_no"]
+    sql = f"""
+        INSERT INTO temp.report_backfill ({", ".join(columns)})
+        VALUES ({", ".join("?" * len(columns))})
+    """
+    # เลขงาน = ลำดับ + MMYY ของวันที่รับงาน (แบบเดียวกับ generate_work_no)
+    period_of = lambda receive: receive[5:7] + receive[2:4]
+    department_of = {}
+
+    rows = iter(rows)
+    with write_tx(conn):
+        conn.execute("DELETE FROM temp.report_backfill")
+        conn.execute("DELETE FROM temp.report_backfill_seq")
+
+        while True:
+            batch = []
+            for receive, asset_no, department, *rest in itertools.islice(rows, BACKFILL_BATCH):
+                # ไฟล์ทำมือบางไฟล์ใส่ชื่อหน่วยงานเต็ม → ชื่อย่อ
+                if department not in department_of:
+                    department_of[department] = get_department_short(department)
+                batch.append((period_of(receive), receive, asset_no, department_of[department], *rest))
+            if not batch:
+                break
+            conn.executemany(sql, batch)
+
+        # ค่าในไฟล์ตัดช่องว่างหัวท้ายแล้ว → ฝั่งฐานข้อมูลตัดด้วย
+        duplicates = conn.execute("""
+            DELETE FROM temp.report_backfill AS b
+            WHERE EXISTS (
+                SELECT 1 FROM reports r
+                WHERE r.receive_at >= datetime(b.receive_datetime)
+                  AND r.receive_at < datetime(b.receive_datetime, '+1 minute')
+                  AND TRIM(COALESCE(r.department, '')) = b.department
+                  AND TRIM(COALESCE(r.reporter, '')) = b.reporter
+                  AND TRIM(COALESCE(r.problem, '')) = b.problem
+            )
+            OR (b.work_no <> '' AND (
+                EXISTS (SELECT 1 FROM reports r WHERE r.work_no = b.work_no)
+                OR b.id <> (
+                    SELECT MIN(d.id) FROM temp.report_backfill d
+                    WHERE d.work_no = b.work_no
+                )
+            ))
+        """).rowcount
+
+        # เลขงานเดิมในไฟล์ → work_no_seq ต้องไม่ต่ำกว่าเลขนั้น (เลขที่จองใหม่จะได้ไม่ชน)
+        conn.execute("""
+            INSERT INTO work_no_seq (period, last_seq)
+            SELECT
+                substr(work_no, -4),
+                MAX(CAST(substr(work_no, 1, length(work_no) - 4) AS INTEGER))
+            FROM temp.report_backfill
+            WHERE length(work_no) >= 7
+            GROUP BY substr(work_no, -4)
+            ON CONFLICT(period) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)
+        """)
+
+        for period, n in conn.execute("""
+            SELECT period, COUNT(*) FROM temp.report_backfill
+            WHERE work_no = ''
+            GROUP BY period
+        """).fetchall():
+            last = conn.execute("""
+                INSERT INTO work_no_seq (period, last_seq)
+                VALUES (?, ?)
+                ON CONFLICT(period) DO UPDATE SET last_seq = last_seq + excluded.last_seq
+                RETURNING last_seq
+            """, (period, n)).fetchone()[0]
+            conn.execute(
+                "INSERT INTO temp.report_backfill_seq (period, start) VALUES (?, ?)",
+                (period, last - n),
+            )
+
+        inserted = conn.execute(f"""
+            INSERT INTO reports (
+                work_no, receive_datetime, {", ".join(BACKFILL_FIELDS)}, created_at
+            )
+            SELECT
+                CASE WHEN b.work_no <> '' THEN b.work_no
+                ELSE printf('%03d', s.start + ROW_NUMBER() OVER (
+                    PARTITION BY b.period, b.work_no ORDER BY b.receive_datetime, b.id
+                )) || b.period
+                END,
+                b.receive_datetime,
+                {", ".join(f"b.{c}" for c in BACKFILL_FIELDS)},
+                b.receive_datetime || ':00'
+            FROM temp.report_backfill b
+            LEFT JOIN temp.report_backfill_seq s ON s.period = b.period
+            ORDER BY b.receive_datetime, b.id
+        """).rowcount
+
+        conn.execute("DELETE FROM temp.report_backfill")
 
-        wb.save(filepath)
+    return inserted, duplicates
 
 
-    return send_file(filepath, as_attachment=True, download_name=filename)
+def backfill_report_files(conn, workbooks):
+    """
+    อ่านขนานใน process pool / เขียนที่ thread นี้ที่เดียว (1 transaction ต่อไฟล์)
+    คืนผลรายไฟล์ [{"name", "rows", "inserted", "duplicates", "skipped", "error"}]
+    """
+    files = []
+    for name, rows, skipped, error in parse_report_workbooks(workbooks):
+        inserted = duplicates = 0
+        if rows:
+            inserted, duplicates = backfill_reports(conn, rows)
+        files.append({
+            "name": name,
+            "rows": len(rows),
+            "inserted": inserted,
+            "duplicates": duplicates,
+            "skipped": skipped,
+            "error": error,
+        })
+    files.sort(key=lambda f: f["name"])
+    return files
+
+
+@app.route("/admin/backfill-reports", methods=["POST"])
+def backfill_reports_route():
+    """
+    อัปโหลดไฟล์ (.xlsx / .zip) → นำเข้าไฟล์ที่อัปโหลด
+    ไม่แนบไฟล์ → นำเข้าไฟล์ .xlsx ทั้งหมดในโฟลเดอร์ history/
+    """
+    # 🔐 กันคนที่ยังไม่ unlock
+    if not session.get("unlocked"):
+        return redirect("/unlock")
+
+    uploads = [f for f in request.files.getlist("file") if f and f.filename]
+    try:
+        if uploads:
+            workbooks = collect_workbooks(uploads)
+        else:
+            workbooks = [(os.path.basename(p), p) for p in backfill_sources()]
+            if not workbooks:
+                raise ImportFileError(
+                    f"ไม่พบไฟล์ .xlsx ในโฟลเดอร์ {REPORT_HISTORY_DIR}/ (แนบไฟล์มา หรือวางไฟล์ในโฟลเดอร์นี้ก่อน)"
+                )
+    except ImportFileError as e:
+        return jsonify(error=str(e)), 400
+
+    files = backfill_report_files(get_db(), workbooks)
+    return jsonify(
+        inserted=sum(f["inserted"] for f in files),
+        duplicates=sum(f["duplicates"] for f in files),
+        files=files,
+    )
 
 
 # ==================================================
@@ -1196,7 +3483,7 @@ def export_excel():
 # ==================================================
 @app.route("/view/<int:report_id>")
 def view_report(report_id):
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
 
     cursor.execute(
@@ -1222,7 +3509,6 @@ def view_report(report_id):
     )
 
     r = cursor.fetchone()
-    conn.close()
 
     if not r:
         return "ไม่พบข้อมูลงาน", 404
@@ -1251,7 +3537,7 @@ def view_report(report_id):
 # ==================================================
 @app.route("/edit/<int:report_id>", methods=["GET", "POST"])
 def edit_report(report_id):
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
 
     if request.method == "POST":
@@ -1297,7 +3583,6 @@ def edit_report(report_id):
         )
 
         conn.commit()
-        conn.close()
         return redirect("/list?success=edit")
 
     cursor.execute(
@@ -1314,7 +3599,6 @@ def edit_report(report_id):
     )
 
     r = cursor.fetchone()
-    conn.close()
 
     receive_date, receive_time = r[2].split(" ")
     complete_date, complete_time = ("", "")
@@ -1346,7 +3630,7 @@ def edit_report(report_id):
 # ==================================================
 @app.route("/delete/<int:report_id>", methods=["POST"])
 def delete_report(report_id):
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
 
     # ดึงชื่อไฟล์ลายเซ็นก่อน (ถ้ามี)
@@ -1357,7 +3641,6 @@ def delete_report(report_id):
     cursor.execute("DELETE FROM reports WHERE id=?", (report_id,))
 
     conn.commit()
-    conn.close()
 
     # ลบไฟล์ลายเซ็นออกจาก disk (ถ้ามี)
     if r and r[0]:
@@ -1376,7 +3659,7 @@ def delete_report(report_id):
 # ==================================================
 @app.route("/copy/<int:report_id>", methods=["POST"])
 def copy_report(report_id):
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
 
     # ดึงข้อมูลต้นฉบับ (ไม่ใช้ SELECT *)
@@ -1403,51 +3686,48 @@ def copy_report(report_id):
     r = cursor.fetchone()
 
     if not r:
-        conn.close()
         return "ไม่พบข้อมูลงานต้นฉบับ", 404
 
-    # สร้างเลขงานใหม่
     created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    work_no = generate_work_no(created_at)
 
-    # INSERT งานใหม่ (ลายเซ็นไม่คัดลอก)
-    cursor.execute(
-        """
-        INSERT INTO reports (
-            work_no,
-            receive_datetime,
-            department,
-            reporter,
-            job_type,
-            asset_no,
-            problem,
-            solution,
-            completed_datetime,
-            close_note,
-            confirm_name,
-            signature,
-            created_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            work_no,
-            r[0],
-            r[1],
-            r[2],
-            r[3],
-            r[4],
-            r[5],
-            r[6],
-            r[7],
-            r[8],
-            r[9],
-            None,  # ❌ ไม่คัดลอกลายเซ็น
-            created_at,
-        ),
-    )
+    # สร้างเลขงานใหม่ + INSERT งานใหม่ (ลายเซ็นไม่คัดลอก)
+    with write_tx(conn):
+        work_no = generate_work_no(conn, created_at)
 
-    conn.commit()
-    conn.close()
+        cursor.execute(
+            """
+            INSERT INTO reports (
+                work_no,
+                receive_datetime,
+                department,
+                reporter,
+                job_type,
+                asset_no,
+                problem,
+                solution,
+                completed_datetime,
+                close_note,
+                confirm_name,
+                signature,
+                created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                work_no,
+                r[0],
+                r[1],
+                r[2],
+                r[3],
+                r[4],
+                r[5],
+                r[6],
+                r[7],
+                r[8],
+                r[9],
+                None,  # ❌ ไม่คัดลอกลายเซ็น
+                created_at,
+            ),
+        )
 
     return redirect("/list")
 
@@ -1474,30 +3754,134 @@ DEPT_FULLNAME = {
     "ห้องรองอธิบดี": "ห้องรองอธิบดี",
 }
 
-@app.route("/assets")
-def assets_list():
-    dept = request.args.get("dept")
-    status = request.args.get("status")
+# เรียงตามประเภท แล้วตามจำนวน O (หลัง /) และ I (ก่อน /) น้อย → มาก
+ASSET_ORDER_BY = """
+    CASE asset_type
+        WHEN 'Computer' THEN 1
+        WHEN 'Notebook' THEN 2
+        WHEN 'Printer' THEN 3
+        WHEN 'Scanner' THEN 4
+        WHEN 'Tablet' THEN 5
+        WHEN 'UPS' THEN 6
+        WHEN 'จอประชาสัมพันธ์' THEN 7
+        ELSE 99
+    END,
+    LENGTH(
+        REPLACE(
+            SUBSTR(asset_no, INSTR(asset_no, '/') + 1),
+            'O', ''
+        )
+    ),
+    LENGTH(
+        REPLACE(
+            SUBSTR(asset_no, 1, INSTR(asset_no, '/') - 1),
+            'I', ''
+        )
+    )
+"""
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
 
+def asset_filter(args):
+    # filter หน่วยงาน + สถานะ (หน้า /assets, export Excel, export CSV)
     where = "WHERE 1=1"
     params = []
 
-    # ===== filter หน่วยงาน =====
+    dept = args.get("dept")
     if dept:
         where += " AND department = ?"
         params.append(dept)
-        page_title = DEPT_FULLNAME.get(dept, dept)
-    else:
-        page_title = "รายการครุภัณฑ์ทั้งหมด"
 
-    # ===== STEP 3: filter สถานะ =====
+    status = args.get("status")
     if status:
         where += " AND status = ?"
         params.append(status)
 
+    return where, params
+
+
+# ลำดับคอลัมน์ในตารางสรุป (ประเภทอื่นที่มีในข้อมูล → ต่อท้ายตามตัวอักษร)
+ASSET_TYPES = [
+    "Computer", "Notebook", "Printer", "Scanner", "Tablet", "UPS",
+    "จอประชาสัมพันธ์",
+]
+
+_asset_aggregate = (None, [])     # (version ของตาราง assets, แถว)
+
+
+def asset_aggregate(conn, q=""):
+    """
+    จำนวนครุภัณฑ์ หน่วยงาน × ประเภท × สถานะ (นับใน SQL)
+    → [(department, asset_type, status, total)]
+    ไม่มีคำค้น → จำไว้ใช้ซ้ำจนกว่าตาราง assets จะถูกเขียน
+    (หน้า /assets/summary กับ export ตารางสรุปใช้ชุดเดียวกัน)
+    """
+    global _asset_aggregate
+
+    sql = """
+        SELECT department, asset_type, status, COUNT(*)
+        FROM assets
+        {where}
+        GROUP BY department, asset_type, status
+        ORDER BY department
+    """
+    if q:
+        return [
+            tuple(r) for r in conn.execute(
+                sql.format(where="WHERE asset_no LIKE ?"), (f"%{q}%",)
+            )
+        ]
+
+    version = table_version(conn, "assets")
+    cached_version, rows = _asset_aggregate
+    if cached_version == version:
+        return rows
+
+    rows = [tuple(r) for r in conn.execute(sql.format(where=""))]
+    _asset_aggregate = (version, rows)
+    return rows
+
+
+def asset_pivot(rows, status=None):
+    """
+    แถวจาก asset_aggregate → ตาราง หน่วยงาน × ประเภท (status = นับเฉพาะสถานะนั้น)
+    คืน (ประเภท, {หน่วยงาน: {"items": {ประเภท: จำนวน}, "total": n}}, รวมทั้งตาราง)
+    คอลัมน์ประเภทมาจากข้อมูลจริง ไม่มีประเภทไหนหล่นหาย
+    """
+    summary = {}
+    grand_total = {"items": {}, "total": 0}
+
+    for dept, a_type, a_status, count in rows:
+        if status and a_status != status:
+            continue
+        data = summary.setdefault(dept, {"items": {}, "total": 0})
+        data["items"][a_type] = data["items"].get(a_type, 0) + count
+        data["total"] += count
+        grand_total["items"][a_type] = grand_total["items"].get(a_type, 0) + count
+        grand_total["total"] += count
+
+    known = len(ASSET_TYPES)
+    types = sorted(
+        grand_total["items"],
+        key=lambda t: (ASSET_TYPES.index(t) if t in ASSET_TYPES else known, t),
+    )
+    return types, summary, grand_total
+
+
+@app.route("/assets")
+def assets_list():
+    dept = request.args.get("dept")
+    status = request.args.get("status")
+
+    conn = get_db()
+    cursor = conn.cursor()
+
+    where, params = asset_filter(request.args)
+
+    if dept:
+        page_title = get_department_full(dept)
+    else:
+        page_title = "รายการครุภัณฑ์ทั้งหมด"
+
     cursor.execute(f"""
         SELECT
             id,
@@ -1511,35 +3895,12 @@ def assets_list():
             status
         FROM assets
         {where}
-        ORDER BY
-            CASE asset_type
-                WHEN 'Computer' THEN 1
-                WHEN 'Notebook' THEN 2
-                WHEN 'Printer' THEN 3
-                WHEN 'Scanner' THEN 4
-                WHEN 'Tablet' THEN 5
-                WHEN 'UPS' THEN 6
-                WHEN 'จอประชาสัมพันธ์' THEN 7
-                ELSE 99
-            END,
-            LENGTH(
-                REPLACE(
-                    SUBSTR(asset_no, INSTR(asset_no, '/') + 1),
-                    'O', ''
-                )
-            ),
-            LENGTH(
-                REPLACE(
-                    SUBSTR(asset_no, 1, INSTR(asset_no, '/') - 1),
-                    'I', ''
-                )
-            )
+        ORDER BY {ASSET_ORDER_BY}
     """, params)
 
 
 
     assets = cursor.fetchall()
-    conn.close()
 
     return render_template(
         "assets_list.html",
@@ -1547,7 +3908,6 @@ def assets_list():
         page_title=page_title,
         current_dept=dept,
         status=status,              # ⭐ ส่งกลับไปให้ select จำค่า
-        dept_map=DEPT_FULLNAME
     )
 
 # ==================================
@@ -1560,7 +3920,7 @@ def assets_search():
     model = request.args.get("model", "").strip()
     owner = request.args.get("owner", "").strip()
     
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
 
     where = "WHERE 1=1"
@@ -1603,7 +3963,6 @@ def assets_search():
     """, params)
 
     assets = cursor.fetchall()
-    conn.close()
 
     return render_template(
         "assets_list.html",
@@ -1611,13 +3970,12 @@ def assets_search():
         page_title="ผลการค้นหาครุภัณฑ์",
         current_dept=None,
         status=None,
-        dept_map=DEPT_FULLNAME
     )
 
     
 @app.route("/assets/add", methods=["GET", "POST"])
 def add_asset():
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
 
     if request.method == "POST":
@@ -1649,32 +4007,26 @@ def add_asset():
             ))
 
             conn.commit()
-            conn.close()
             return redirect("/assets")
 
         except Exception as e:
-            conn.close()
+            conn.rollback()
             return f"เกิดข้อผิดพลาด: {e}"
 
-    conn.close()
-    return render_template(
-        "assets_add.html",
-        dept_map=DEPT_FULLNAME
-    )
+    return render_template("assets_add.html")
    
     
 @app.route("/assets/delete/<int:asset_id>")
 def delete_asset(asset_id):
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM assets WHERE id = ?", (asset_id,))
     conn.commit()
-    conn.close()
     return redirect("/assets?success=delete")
 
 @app.route("/assets/edit/<int:asset_id>", methods=["GET", "POST"])
 def edit_asset(asset_id):
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cursor = conn.cursor()
 
     if request.method == "POST":
@@ -1705,12 +4057,10 @@ def edit_asset(asset_id):
             asset_id
         ))
         conn.commit()
-        conn.close()
         return redirect("/assets?success=edit")
 
     cursor.execute("SELECT * FROM assets WHERE id = ?", (asset_id,))
     asset = cursor.fetchone()
-    conn.close()
 
     if not asset:
         return "ไม่พบข้อมูล", 404
@@ -1718,300 +4068,131 @@ def edit_asset(asset_id):
     return render_template("assets_edit.html", asset=asset)
 
 @app.route("/assets/export-excel")
-def export_assets_excel():
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-    from flask import send_file, request
-    from datetime import datetime
-    import io
-    
-    status = request.args.get("status")
-    dept = request.args.get("dept")
-
-        # ======================
-    # ดึงข้อมูล (รองรับ dept + status)
-    # ======================
-    conn = get_db()
-    cursor = conn.cursor()
-
-    where = "WHERE 1=1"
-    params = []
-
-    if dept:
-        where += " AND department = ?"
-        params.append(dept)
-        dept_full = DEPT_FULLNAME.get(dept, dept)
-    else:
-        dept_full = "รายการครุภัณฑ์ทั้งหมด"
-
-    # ⭐ STEP 3: filter ตามสถานะ
-    if status:
-        where += " AND status = ?"
-        params.append(status)
-
-    cursor.execute(f"""
-        SELECT
-            asset_no,
-            asset_type,
-            asset_model,
-            serial_no,
-            hostname,
-            owner_name,
-            department,
-            position
-        FROM assets
-        {where}
-        ORDER BY
-            CASE asset_type
-                WHEN 'Computer' THEN 1
-                WHEN 'Notebook' THEN 2
-                WHEN 'Printer' THEN 3
-                WHEN 'Scanner' THEN 4
-                WHEN 'Tablet' THEN 5
-                WHEN 'UPS' THEN 6
-                WHEN 'จอประชาสัมพันธ์' THEN 7
-                ELSE 99
-            END,
-            -- OO (ตัว O หลัง /) น้อย → มาก
-            LENGTH(
-                REPLACE(
-                    SUBSTR(asset_no, INSTR(asset_no, '/') + 1),
-                    'O', ''
-                )
-            ),
-            -- I (ตัว I ก่อน /) น้อย → มาก
-            LENGTH(
-                REPLACE(
-                    SUBSTR(asset_no, 1, INSTR(asset_no, '/') - 1),
-                    'I', ''
-                )
-            )
-
-    """, params)
-
-    rows = cursor.fetchall()
-    conn.close()
-
-    # ======================
-    # Excel
-    # ======================
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "รายการครุภัณฑ์"
-
-    # A4 แนวนอน (ไม่ fit)
-    ws.page_setup.paperSize = ws.PAPERSIZE_A4
-    ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
-    ws.print_title_rows = "3:3"
-
-    # ===== style =====
-    center = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    left = Alignment(horizontal="left", vertical="center", wrap_text=True)
-
-    font_title = Font(bold=True, size=14)
-    font_header = Font(bold=True, size=10)
-    font_normal = Font(size=9)
-
-    thin = Side(style="thin")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    no_border = Border()
-
-    # ======================
-    # แถว 1 : ชื่อหน่วยงาน (ไม่มีขอบ)
-    # ======================
-    ws.merge_cells("A1:I1")
-    c = ws["A1"]
-    c.value = dept_full
-    c.font = font_title
-    c.alignment = center
-    ws.row_dimensions[1].height = 28
-
-    # ======================
-    # แถว 2 : เว้น (ไม่มีขอบ)
-    # ======================
-    ws.append([])
-    ws.row_dimensions[2].height = 16
-
-    # ======================
-    # แถว 3 : หัวตาราง
-    # ======================
-    headers = [
-        "ลำดับ",
-        "เลขครุภัณฑ์",
-        "ประเภท",
-        "รุ่น",
-        "Serial",
-        "ชื่อเครื่อง",
-        "ผู้ครอบครอง",
-        "หน่วยงาน",
-        "ตำแหน่ง",
-    ]
-    ws.append(headers)
-
-    for col in range(1, 10):
-        cell = ws.cell(row=3, column=col)
-        cell.font = font_header
-        cell.alignment = center
-        cell.border = border
+def export_assets_excel():
+    return respond_export(build_assets_export, request.args)
 
-    ws.row_dimensions[3].height = 24
 
-    # ======================
-    # ข้อมูล
-    # ======================
-    start_row = 4
-    for idx, r in enumerate(rows):
-        row_no = start_row + idx
-
-        ws.append([
-            idx + 1,
-            r[0],
-            r[1],
-            r[2],
-            r[3],
-            r[4],
-            r[5],
-            r[6],
-            r[7],
-        ])
+ASSETS_EXPORT = {
+    "sheet": "รายการครุภัณฑ์",
+    # A4 แนวนอน (ไม่ fit) / หัวตารางพิมพ์ซ้ำทุกหน้า
+    "page": {"orientation": "landscape", "print_title_rows": "3:3"},
+    "styles": {
+        "assets_title": dict(font=Font(bold=True, size=14), alignment=CENTER_WRAP),
+        "assets_header": dict(
+            font=Font(bold=True, size=10), alignment=CENTER_WRAP, border=BOX
+        ),
+        "assets_body": dict(font=Font(size=9), alignment=CENTER_WRAP, border=BOX),
+        "assets_sign": dict(
+            font=Font(size=10),
+            alignment=Alignment(horizontal="right", vertical="center"),
+        ),
+    },
+    "header": {"style": "assets_header", "height": 24},
+    "body": {"style": "assets_body", "height": 20},
+    # ความกว้างคอลัมน์ (ตามรูปที่ส่ง)
+    "columns": [
+        export_column("ลำดับ", 6, ROW_NO),
+        export_column("เลขครุภัณฑ์", 20, "asset_no"),
+        export_column("ประเภท", 12, "asset_type"),
+        export_column("รุ่น", 18, "asset_model"),
+        export_column("Serial", 16, "serial_no"),
+        export_column("ชื่อเครื่อง", 18, "hostname"),
+        export_column("ผู้ครอบครอง", 20, "owner_name"),
+        export_column("หน่วยงาน", 10, "department"),
+        export_column("ตำแหน่ง", 14, "position"),
+    ],
+}
 
-        for col in range(1, 10):
-            cell = ws.cell(row=row_no, column=col)
-            cell.font = font_normal
-            cell.alignment = center
-            cell.border = border
 
-        ws.row_dimensions[row_no].height = 20
+def build_assets_export(args, progress=None):
+    status = args.get("status")
+    dept = args.get("dept")
 
-    # ======================
-    # เว้น 2 แถว + ลายเซ็นผู้ตรวจสอบ
-    # ======================
-    sign_row = ws.max_row + 3
-    ws.merge_cells(start_row=sign_row, start_column=1, end_row=sign_row, end_column=9)
+    filename = f"assets_A4_landscape_{datetime.now().strftime('%Y%m%d')}.xlsx"
 
-    sign = ws.cell(row=sign_row, column=1)
-    sign.value = "ลายเซ็นผู้ตรวจสอบ ............................................................."
-    sign.font = Font(size=10)
-    sign.alignment = Alignment(horizontal="right", vertical="center")
+    conn = get_db()
 
-    ws.row_dimensions[sign_row].height = 26
+    path = export_cache_path(
+        conn, "assets", {"dept": dept, "status": status},
+        ["assets", "departments"]
+    )
+    if os.path.exists(path):
+        return path, filename
 
     # ======================
-    # ความกว้างคอลัมน์ (ตามรูปที่ส่ง)
+    # ดึงข้อมูล (รองรับ dept + status)
     # ======================
-    widths = [
-        6,   # A ลำดับ
-        20,  # B เลขครุภัณฑ์
-        12,  # C ประเภท
-        18,  # D รุ่น
-        16,  # E Serial
-        18,  # F ชื่อเครื่อง
-        20,  # G ผู้ครอบครอง
-        10,  # H หน่วยงาน
-        14,  # I ตำแหน่ง
-    ]
+    where, params = asset_filter(args)
 
-    for i, w in enumerate(widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = w
+    if dept:
+        dept_full = get_department_full(dept)
+    else:
+        dept_full = "รายการครุภัณฑ์ทั้งหมด"
 
-    # ======================
-    # ส่งไฟล์
-    # ======================
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    total = cached_count(conn, "assets", f"SELECT COUNT(*) FROM assets {where}", params)
 
-    filename = f"assets_A4_landscape_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    cursor = conn.execute(f"""
+        SELECT
+            asset_no,
+            asset_type,
+            asset_model,
+            serial_no,
+            hostname,
+            owner_name,
+            department,
+            position
+        FROM assets
+        {where}
+        ORDER BY {ASSET_ORDER_BY}
+    """, params)
 
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ncol = len(ASSETS_EXPORT["columns"])
+    title = [
+        # แถว 1 : ชื่อหน่วยงาน (ไม่มีขอบ) / แถว 2 : เว้น
+        sheet_row([dept_full], "assets_title", 28, merge=(1, ncol)),
+        sheet_row(height=16),
+    ]
+    footer = [
+        # เว้น 2 แถว + ลายเซ็นผู้ตรวจสอบ
+        sheet_row(),
+        sheet_row(),
+        sheet_row(["ลายเซ็นผู้ตรวจสอบ ............................................................."],
+                  "assets_sign", 26, merge=(1, ncol)),
+    ]
+
+    write_export(
+        ASSETS_EXPORT, path, cursor, title=title, footer=footer,
+        progress=progress, total=total,
     )
+    return path, filename
 
 
 @app.route("/assets/summary")
 def assets_summary():
     q = request.args.get("q", "").strip()
+    status = request.args.get("status", "")
 
     conn = get_db()
     cursor = conn.cursor()
 
     # =========================
-    # 1) ดึงข้อมูลสำหรับ Summary / Graph
+    # 1) ตัวเลขสรุป หน่วยงาน × ประเภท (ใช้ร่วมกับ export)
     # =========================
-    if q:
-        cursor.execute("""
-            SELECT department, asset_type
-            FROM assets
-            WHERE asset_no LIKE ?
-        """, (f"%{q}%",))
-    else:
-        cursor.execute("""
-            SELECT department, asset_type
-            FROM assets
-        """)
+    rows = asset_aggregate(conn, q)
+    types, summary, grand_total = asset_pivot(rows, status)
+    statuses = sorted({r[2] for r in rows if r[2]})
 
-    rows = cursor.fetchall()
-    
-    
     # ===== mapping ชื่อย่อ -> ชื่อเต็ม =====
-    dept_fullname = {}
-
-    cursor.execute("""
-        SELECT short_name, full_name
-        FROM departments
-        WHERE active = 1
-    """)
-
-    for short, full in cursor.fetchall():
-        dept_fullname[short] = full
-        
-        
-
-    # =========================
-    # 2) สรุปข้อมูลตามหน่วยงาน
-    # =========================
-    summary = {}
-    types = set()
-    type_total = {}
-    dept_total = {}
-
-    for dept, a_type in rows:
-        if dept not in summary:
-            summary[dept] = {
-                "items": {},
-                "total": 0
-            }
-
-        summary[dept]["items"][a_type] = summary[dept]["items"].get(a_type, 0) + 1
-        summary[dept]["total"] += 1
-
-        types.add(a_type)
-        type_total[a_type] = type_total.get(a_type, 0) + 1
-
-    for dept, data in summary.items():
-        dept_total[dept] = data["total"]
-
-    types = sorted(types)
+    dept_fullname = department_map(active_only=True)
 
     # =========================
-    # 3) Grand Total ทั้งตาราง
+    # 2) รวมแยกตามประเภท / หน่วยงาน (กราฟ)
     # =========================
-    grand_total = {
-        "items": {},
-        "total": 0
-    }
-
-    for dept, data in summary.items():
-        for t, count in data["items"].items():
-            grand_total["items"][t] = grand_total["items"].get(t, 0) + count
-            grand_total["total"] += count
+    type_total = grand_total["items"]
+    dept_total = {dept: data["total"] for dept, data in summary.items()}
 
     # =========================
-    # 4) 🔍 ค้นหา “เครื่องรายตัว” ตามเลขครุภัณฑ์
+    # 3) 🔍 ค้นหา “เครื่องรายตัว” ตามเลขครุภัณฑ์
     # =========================
     asset_detail = None
 
@@ -2029,12 +4210,11 @@ def assets_summary():
             FROM assets
             WHERE asset_no LIKE ?
         """, (f"%{q}%",))
-    asset_detail = cursor.fetchone()
+        asset_detail = cursor.fetchone()
 
-    conn.close()
 
     # =========================
-    # 5) ส่งไปที่ Template
+    # 4) ส่งไปที่ Template
     # =========================
     return render_template(
         "assets_summary.html",
@@ -2046,7 +4226,9 @@ def assets_summary():
         grand_total=grand_total,
         asset_detail=asset_detail,   # ✅ เพิ่มตรงนี้
         dept_fullname=dept_fullname,   # 👈 เพิ่มบรรทัดนี้
-        keyword=q
+        keyword=q,
+        statuses=statuses,
+        status=status,
     )
 
 from openpyxl import Workbook
@@ -2058,27 +4240,68 @@ from collections import defaultdict
 
 @app.route("/report-monthly-summary/export")
 def export_report_monthly_summary():
+    return respond_export(build_monthly_summary_export, request.args, monthly_snapshot_key)
+
+
+MONTHLY_TYPES = ["Software", "Hardware", "Network", "Other"]
+
+MONTHLY_EXPORT = {
+    "sheet": "Monthly Summary",
+    "styles": {
+        "monthly_title": dict(font=Font(bold=True, size=14), alignment=CENTER),
+        "monthly_subtitle": dict(alignment=CENTER),
+        "monthly_header": dict(
+            font=Font(bold=True),
+            alignment=CENTER,
+            border=BOX,
+            fill=PatternFill(
+                start_color="DBEAFE",  # ฟ้าอ่อน
+                end_color="DBEAFE",
+                fill_type="solid"
+            ),
+        ),
+        "monthly_body": dict(alignment=CENTER, border=BOX),
+        "monthly_total": dict(font=Font(bold=True), alignment=CENTER, border=BOX),
+    },
+    "header": {"style": "monthly_header", "height": 30},
+    "body": {"style": "monthly_body", "height": 26},
+    "columns": (
+        [export_column("ลำดับ", 8, ROW_NO), export_column("หน่วยงาน", 24, "dept")]
+        + [export_column(t, 14, t) for t in MONTHLY_TYPES]
+        + [export_column("รวม", 14, "total")]
+    ),
+}
 
-    month = request.args.get("month", type=int)
-    year = request.args.get("year", type=int)
-    department_filter = request.args.get("department", "")
 
-    last_day = calendar.monthrange(year, month)[1]
-    date_from = f"{year}-{month:02d}-01"
-    date_to = f"{year}-{month:02d}-{last_day}"
+def build_monthly_summary_export(args, progress=None):
+
+    month = args.get("month", type=int)
+    year = args.get("year", type=int)
+    department_filter = args.get("department", "")
+
+    if not month or not year:
+        raise ExportError("กรุณาเลือกเดือนและปี")
+
+    filename = f"ตารางสรุปงานรายเดือน_{thai_month_year(month, year)}.xlsx"
 
     # ================= DB =================
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cur = conn.cursor()
 
+    path = export_cache_path(
+        conn, "monthly",
+        {"year": year, "month": month, "department": department_filter},
+        ["reports"]
+    )
+    if os.path.exists(path):
+        return path, filename
+
     sql = """
-        SELECT department, job_type, COUNT(*) AS total
-        FROM reports
-        WHERE receive_datetime >= ?
-          AND receive_datetime <= ?
+        SELECT department, job_type, SUM(total) AS total
+        FROM report_monthly_rollup
+        WHERE year = ? AND month = ?
     """
-    params = [f"{date_from} 00:00", f"{date_to} 23:59"]
+    params = [year, month]
 
     if department_filter:
         sql += " AND department = ?"
@@ -2088,10 +4311,9 @@ def export_report_monthly_summary():
 
     cur.execute(sql, params)
     rows = cur.fetchall()
-    conn.close()
 
     # ================= เตรียมข้อมูล =================
-    types = ["Software", "Hardware", "Network", "Other"]
+    types = MONTHLY_TYPES
     summary = defaultdict(lambda: {t: 0 for t in types})
 
     for r in rows:
@@ -2101,102 +4323,29 @@ def export_report_monthly_summary():
             t = "Other"
         summary[dept][t] += r["total"]
 
-    # ================= Excel =================
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Monthly Summary"
-
-    bold = Font(bold=True)
-    center = Alignment(horizontal="center", vertical="center")
-    thin = Side(style="thin")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-
-    header_fill = PatternFill(
-        start_color="DBEAFE",  # ฟ้าอ่อน
-        end_color="DBEAFE",
-        fill_type="solid"
-    )
-
-    # ---------- หัวรายงาน ----------
-    ws.merge_cells("A1:G1")
-    ws["A1"] = "ตารางสรุปงานรายเดือน"
-    ws["A1"].font = Font(bold=True, size=14)
-    ws["A1"].alignment = center
-    ws.row_dimensions[1].height = 34
-
-    ws.merge_cells("A2:G2")
-    ws["A2"] = f"ประจำเดือน {thai_month_year(month, year)}"
-    ws["A2"].alignment = center
-    ws.row_dimensions[2].height = 26
-
-    # ---------- หัวตาราง ----------
-    headers = ["ลำดับ", "หน่วยงาน"] + types + ["รวม"]
-    ws.append(headers)
-
-    for col in range(1, 8):
-        cell = ws.cell(row=3, column=col)
-        cell.font = bold
-        cell.alignment = center
-        cell.border = border
-        cell.fill = header_fill
-
-    ws.row_dimensions[3].height = 30
-
-    # ---------- เนื้อข้อมูล ----------
-    row_idx = 4
-    index = 1
-    grand_total = {t: 0 for t in types}
-
-    for dept, data in summary.items():
-        total = sum(data.values())
-        ws.append([index, dept] + [data[t] for t in types] + [total])
-
-        for col in range(1, 8):
-            cell = ws.cell(row=row_idx, column=col)
-            cell.border = border
-            cell.alignment = center
-
-        ws.row_dimensions[row_idx].height = 26
-
-        for t in types:
-            grand_total[t] += data[t]
-
-        index += 1
-        row_idx += 1
-
-    # ---------- แถวรวม ----------
-    ws.append(
-        ["", "รวมทั้งหมด"] +
-        [grand_total[t] for t in types] +
-        [sum(grand_total.values())]
-    )
-
-    for col in range(1, 8):
-        cell = ws.cell(row=row_idx, column=col)
-        cell.font = bold
-        cell.border = border
-        cell.alignment = center
-
-    ws.row_dimensions[row_idx].height = 30
-
-    # ---------- ความกว้างคอลัมน์ ----------
-    widths = [8, 24, 14, 14, 14, 14, 14]
-    for i, w in enumerate(widths, start=1):
-        ws.column_dimensions[chr(64+i)].width = w
-
-    # ================= ส่งไฟล์ =================
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    table = [
+        dict(data, dept=dept, total=sum(data.values()))
+        for dept, data in summary.items()
+    ]
+    grand_total = {t: sum(row[t] for row in table) for t in types}
 
-    filename = f"ตารางสรุปงานรายเดือน_{thai_month_year(month, year)}.xlsx"
+    ncol = len(MONTHLY_EXPORT["columns"])
+    title = [
+        sheet_row(["ตารางสรุปงานรายเดือน"], "monthly_title", 34, merge=(1, ncol)),
+        sheet_row([f"ประจำเดือน {thai_month_year(month, year)}"],
+                  "monthly_subtitle", 26, merge=(1, ncol)),
+    ]
+    footer = [
+        sheet_row(
+            ["", "รวมทั้งหมด"] +
+            [grand_total[t] for t in types] +
+            [sum(grand_total.values())],
+            "monthly_total", 30,
+        ),
+    ]
 
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    write_export(MONTHLY_EXPORT, path, table, title=title, footer=footer)
+    return path, filename
 
 
 # ==================================================
@@ -2214,7 +4363,7 @@ def attendance_checkin():
     work_date = now.strftime("%Y-%m-%d")
     time_now = now.strftime("%H:%M")
 
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("""
@@ -2237,7 +4386,6 @@ def attendance_checkin():
         """, (staff_name, work_date, time_now))
 
     conn.commit()
-    conn.close()
 
     return redirect(f"/attendance?staff_name={staff_name}")
 
@@ -2261,7 +4409,7 @@ def attendance_checkout():
     work_date = now.strftime("%Y-%m-%d")
     time_now = now.strftime("%H:%M")
 
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("""
@@ -2271,7 +4419,6 @@ def attendance_checkout():
     """, (time_now, staff_name, work_date))
 
     conn.commit()
-    conn.close()
 
     return redirect(f"/attendance?staff_name={staff_name}")
 
@@ -2295,7 +4442,8 @@ def work_compare():
     )
     date_to = request.args.get(
         "date_to",
-        f"{today.year}-{today.month:02d}-31"
+        f"{today.year}-{today.month:02d}-"
+        f"{calendar.monthrange(today.year, today.month)[1]:02d}"
     )
 
     labels = ["Software", "Hardware", "Network", "Other"]
@@ -2308,23 +4456,32 @@ def work_compare():
     }
 
     if person1 and person2:
-        conn = sqlite3.connect(DB_NAME)
+        conn = get_db()
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT confirm_name, job_type, COUNT(*)
-            FROM reports
-            WHERE confirm_name IN (?, ?)
-              AND receive_datetime BETWEEN ? AND ?
-            GROUP BY confirm_name, job_type
-        """, (
-            person1, person2,
-            f"{date_from} 00:00",
-            f"{date_to} 23:59"
-        ))
+        months = whole_months(date_from, date_to)
+
+        if months:
+            # ช่วงเต็มเดือน → อ่านจากตารางสรุปรายเดือน
+            (y1, m1), (y2, m2) = months
+            cur.execute("""
+                SELECT confirm_name, job_type, SUM(total)
+                FROM report_monthly_rollup
+                WHERE (year, month) >= (?, ?)
+                  AND (year, month) <= (?, ?)
+                  AND confirm_name IN (?, ?)
+                GROUP BY confirm_name, job_type
+            """, (y1, m1, y2, m2, person1, person2))
+        else:
+            cur.execute("""
+                SELECT confirm_name, job_type, COUNT(*)
+                FROM reports
+                WHERE confirm_name IN (?, ?)
+                  AND receive_at >= ? AND receive_at < ?
+                GROUP BY confirm_name, job_type
+            """, (person1, person2) + day_range(date_from, date_to))
 
         rows = cur.fetchall()
-        conn.close()
 
         index = {k: i for i, k in enumerate(labels)}
 
@@ -2365,126 +4522,69 @@ def work_compare():
 # ==================================================
 @app.route("/assets/export-summary")
 def export_assets_summary():
-    import sqlite3
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, Border, Side
-    from flask import send_file
-    from io import BytesIO
-    from datetime import datetime
+    return respond_export(build_asset_summary_export, request.args)
+
+
+ASSET_SUMMARY_EXPORT = {
+    "sheet": "ตารางสรุปครุภัณฑ์",
+    # A4 แนวตั้ง
+    "page": {"orientation": "portrait", "fit": True, "print_title_rows": "1:1"},
+    "styles": {
+        "asum_header": dict(font=Font(bold=True, size=11), alignment=CENTER, border=BOX),
+        "asum_body": dict(font=Font(size=10), alignment=CENTER, border=BOX),
+        "asum_total": dict(font=Font(bold=True, size=10), alignment=CENTER, border=BOX),
+    },
+    "header": {"style": "asum_header", "height": 20},
+    "body": {"style": "asum_body", "height": 20},
+    # คอลัมน์ประเภทสร้างตามข้อมูล (asset_summary_columns)
+    "columns": [],
+}
 
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+# ความกว้างคอลัมน์ (คุมให้พอดี A4 แนวตั้ง) ไม่ระบุ = 9
+ASSET_SUMMARY_WIDTHS = {"UPS": 8, "จอประชาสัมพันธ์": 12}
 
-    cur.execute("""
-        SELECT
-            department,
-            SUM(CASE WHEN asset_type='Computer' THEN 1 ELSE 0 END) AS Computer,
-            SUM(CASE WHEN asset_type='Notebook' THEN 1 ELSE 0 END) AS Notebook,
-            SUM(CASE WHEN asset_type='Printer' THEN 1 ELSE 0 END) AS Printer,
-            SUM(CASE WHEN asset_type='Scanner' THEN 1 ELSE 0 END) AS Scanner,
-            SUM(CASE WHEN asset_type='Tablet' THEN 1 ELSE 0 END) AS Tablet,
-            SUM(CASE WHEN asset_type='UPS' THEN 1 ELSE 0 END) AS UPS,
-            SUM(CASE WHEN asset_type='Display' THEN 1 ELSE 0 END) AS Display,
-            COUNT(*) AS total
-        FROM assets
-        GROUP BY department
-        ORDER BY department
-    """)
-    rows = cur.fetchall()
-    conn.close()
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "ตารางสรุปครุภัณฑ์"
+def asset_summary_columns(types):
+    return (
+        [export_column("หน่วยงาน", 12, "department")]     # แคบ
+        + [
+            export_column(
+                t, ASSET_SUMMARY_WIDTHS.get(t, 9),
+                lambda row, t=t: row["items"].get(t, 0),
+            )
+            for t in types
+        ]
+        + [export_column("รวม", 9, "total")]
+    )
 
-    # ===== ตั้งค่าหน้ากระดาษ A4 แนวตั้ง =====
-    ws.page_setup.paperSize = ws.PAPERSIZE_A4
-    ws.page_setup.orientation = ws.ORIENTATION_PORTRAIT
-    ws.page_setup.fitToHeight = 1
-    ws.page_setup.fitToWidth = 1
-    ws.print_title_rows = "1:1"
 
-    headers = [
-        "หน่วยงาน", "Computer", "Notebook", "Printer",
-        "Scanner", "Tablet", "UPS", "จอประชาสัมพันธ์", "รวม"
-    ]
-    ws.append(headers)
-
-    # ===== style =====
-    header_font = Font(bold=True, size=11)
-    body_font = Font(size=10)
-    bold_font = Font(bold=True, size=10)
-    center = Alignment(horizontal="center", vertical="center")
-    border = Border(
-        left=Side(style="thin"),
-        right=Side(style="thin"),
-        top=Side(style="thin"),
-        bottom=Side(style="thin")
-    )
+def build_asset_summary_export(args, progress=None):
+    status = args.get("status", "")
+    filename = f"asset_summary_A4_{datetime.now().strftime('%Y%m%d')}.xlsx"
 
-    # header
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.alignment = center
-        cell.border = border
+    conn = get_db()
 
-    # data
-    for r in rows:
-        ws.append(r)
+    path = export_cache_path(conn, "asset_summary", {"status": status}, ["assets"])
+    if os.path.exists(path):
+        return path, filename
 
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-        for cell in row:
-            cell.font = body_font
-            cell.alignment = center
-            cell.border = border
+    # ตัวเลขชุดเดียวกับหน้า /assets/summary
+    types, summary, grand_total = asset_pivot(asset_aggregate(conn), status)
+    rows = [dict(data, department=dept) for dept, data in summary.items()]
 
     # ===== แถวรวมล่างสุด =====
-    ws.append([
-        "รวมทั้งหมด",
-        sum(r[1] for r in rows),
-        sum(r[2] for r in rows),
-        sum(r[3] for r in rows),
-        sum(r[4] for r in rows),
-        sum(r[5] for r in rows),
-        sum(r[6] for r in rows),
-        sum(r[7] for r in rows),
-        sum(r[8] for r in rows),
-    ])
-
-    total_row = ws.max_row
-    for cell in ws[total_row]:
-        cell.font = bold_font
-        cell.alignment = center
-        cell.border = border
-
-    # ===== ความสูงแถว (เล็กลง) =====
-    for i in range(1, ws.max_row + 1):
-        ws.row_dimensions[i].height = 20
-
-    # ===== ความกว้างคอลัมน์ (คุมให้พอดี A4 แนวตั้ง) =====
-    ws.column_dimensions["A"].width = 12   # หน่วยงาน (แคบ)
-    ws.column_dimensions["B"].width = 9
-    ws.column_dimensions["C"].width = 9
-    ws.column_dimensions["D"].width = 9
-    ws.column_dimensions["E"].width = 9
-    ws.column_dimensions["F"].width = 9
-    ws.column_dimensions["G"].width = 8
-    ws.column_dimensions["H"].width = 12   # จอประชาสัมพันธ์ (แคบ)
-    ws.column_dimensions["I"].width = 9    # รวม
-
-    # ===== ส่งไฟล์ =====
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    filename = f"asset_summary_A4_{datetime.now().strftime('%Y%m%d')}.xlsx"
+    footer = [
+        sheet_row(
+            ["รวมทั้งหมด"]
+            + [grand_total["items"][t] for t in types]
+            + [grand_total["total"]],
+            "asum_total", 20,
+        ),
+    ]
 
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    spec = dict(ASSET_SUMMARY_EXPORT, columns=asset_summary_columns(types))
+    write_export(spec, path, rows, footer=footer)
+    return path, filename
 
 # ==================================================
 # ใส่รหัส
@@ -2511,7 +4611,7 @@ def unlock():
 # ==================================================
 @app.route("/admin/force-830")
 def force_830():
-    conn = sqlite3.connect("report.db")
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("""
@@ -2522,7 +4622,6 @@ def force_830():
 
     conn.commit()
     updated = cur.rowcount
-    conn.close()
 
     return f"เปลี่ยนเวลาเป็น 08:30 แล้ว {updated} รายการ"
 
@@ -2535,7 +4634,7 @@ def reset_check_status():
     import sqlite3
     from flask import redirect, url_for, flash
 
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_db()
     cur = conn.cursor()
 
     # รีเซ็ทเฉพาะครุภัณฑ์ที่ยังใช้งานอยู่
@@ -2546,20 +4645,314 @@ def reset_check_status():
     """)
 
     conn.commit()
-    conn.close()
 
     flash("เริ่มรอบการตรวจสอบใหม่เรียบร้อยแล้ว", "success")
     return redirect(url_for("assets_list"))
 
 
 
+# ==================================================
+# ส่งออก CSV / NDJSON แบบ stream (ไม่ผ่าน openpyxl)
+# ==================================================
+import csv
+from flask import Response, stream_with_context
+
+STREAM_BATCH = 500
+STREAM_MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+
+def stream_rows(cursor, fmt):
+    """
+    อ่านจาก cursor ทีละ STREAM_BATCH แถว แล้วส่งออกทีละก้อน
+    ไม่มีการโหลดทั้งชุดข้อมูลเข้าหน่วยความจำ
+    CSV ขึ้นต้นด้วย BOM → Excel เปิดภาษาไทยได้ถูกต้อง
+    """
+    columns = [d[0] for d in cursor.description]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    if fmt == "csv":
+        buf.write("\ufeff")
+        writer.writerow(columns)
+
+    while True:
+        rows = cursor.fetchmany(STREAM_BATCH)
+        if not rows:
+            break
+
+        if fmt == "csv":
+            writer.writerows(rows)
+        else:
+            for r in rows:
+                buf.write(json.dumps(dict(zip(columns, r)), ensure_ascii=False))
+                buf.write("\n")
+
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+
+    if buf.tell():
+        # CSV ที่ไม่มีข้อมูล → ส่งแค่หัวคอลัมน์
+        yield buf.getvalue().encode("utf-8")
+
+
+def _stream_and_close(cursor, fmt):
+    # stream อ่าน cursor หลังจบ request ไปแล้ว → connection เป็นของ stream ปิดเองเมื่อส่งครบ / ผู้ใช้ยกเลิก
+    try:
+        yield from stream_rows(cursor, fmt)
+    finally:
+        cursor.connection.close()
+
+
+def stream_export(cursor, fmt, name):
+    # เอาออกจาก g → close_db ตอนจบ request จะไม่ปิดก่อน stream อ่านเสร็จ
+    if g.get("db") is cursor.connection:
+        g.pop("db")
+    return Response(
+        stream_with_context(_stream_and_close(cursor, fmt)),
+        # content_type = ใช้ตามนี้เลย (mimetype= จะโดนเติม charset ซ้ำ)
+        content_type=STREAM_MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={name}.{fmt}"},
+    )
+
+
+@app.route("/list/export.<any(csv, ndjson):fmt>")
+def stream_reports(fmt):
+    now = datetime.now()
+    conn = get_db()
+
+    # filter เดียวกับหน้า /list (q, job_type, staff, date_from, date_to)
+    source, source_params, where, params, order_by = report_list_filter(
+        conn, request.args, now
+    )
+
+    cursor = conn.execute(f"""
+        SELECT
+            reports.id AS id,
+            work_no,
+            receive_at,
+            department,
+            reporter,
+            job_type,
+            asset_no,
+            problem,
+            solution,
+            completed_at,
+            close_note,
+            confirm_name
+        {source}
+        {where}
+        ORDER BY {order_by or "receive_at DESC, reports.id DESC"}
+    """, source_params + params)
+
+    return stream_export(cursor, fmt, f"reports_{now.strftime('%Y%m%d')}")
+
+
+@app.route("/assets/export.<any(csv, ndjson):fmt>")
+def stream_assets(fmt):
+    conn = get_db()
+
+    # filter เดียวกับหน้า /assets (dept, status)
+    where, params = asset_filter(request.args)
+
+    cursor = conn.execute(f"""
+        SELECT
+            id,
+            asset_no,
+            asset_type,
+            asset_model,
+            serial_no,
+            mac_address,
+            hostname,
+            owner_name,
+            position,
+            department,
+            status,
+            note
+        FROM assets
+        {where}
+        ORDER BY {ASSET_ORDER_BY}
+    """, params)
+
+    return stream_export(cursor, fmt, f"assets_{datetime.now().strftime('%Y%m%d')}")
+
+
+@app.route("/attendance/export.<any(csv, ndjson):fmt>")
+def stream_attendance(fmt):
+    # filter เดียวกับหน้า /attendance (month, staff_name)
+    year, month = attendance_period(request.args.get("month", type=int), datetime.now())
+    last_day = monthrange(year, month)[1]
+    month_start = f"{year}-{month:02d}-01"
+    month_end = f"{year}-{month:02d}-{last_day}"
+
+    where = "WHERE work_date BETWEEN ? AND ?"
+    params = [month_start, month_end]
+
+    staff_name = request.args.get("staff_name", "")
+    if staff_name:
+        where += " AND staff_name = ?"
+        params.append(staff_name)
+
+    cursor = get_db().execute(f"""
+        SELECT staff_name, work_date, time_in, time_out, note
+        FROM attendance
+        {where}
+        ORDER BY work_date DESC, staff_name
+    """, params)
+
+    return stream_export(cursor, fmt, f"attendance_{year}-{month:02d}")
+
+
+# ==================================================
+# คิว export เบื้องหลัง (submit → ดูสถานะ → ดาวน์โหลด)
+# ==================================================
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify
+from werkzeug.datastructures import MultiDict
+
+EXPORT_JOB_WORKERS = 2
+EXPORT_JOB_KEEP = 3600      # เก็บสถานะงานที่จบแล้วไว้ 1 ชม.
+
+# ชนิด export → (ฟังก์ชันสร้างไฟล์, พารามิเตอร์ที่ใช้)
+EXPORTERS = {
+    "report": (build_report_export, ("date_from", "date_to")),
+    "attendance": (build_attendance_export, ("staff_name", "year", "month")),
+    "assets": (build_assets_export, ("dept", "status")),
+    "asset_summary": (build_asset_summary_export, ("status",)),
+    "monthly": (build_monthly_summary_export, ("year", "month", "department")),
+}
+
+_export_pool = ThreadPoolExecutor(
+    max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export"
+)
+_export_jobs = {}          # job_id → สถานะงาน
+_export_inflight = {}      # (ชนิด, พารามิเตอร์) → job_id ที่ยังไม่จบ
+_export_jobs_lock = threading.Lock()
+
+
+def submit_export_job(kind, values):
+    """
+    ส่งงาน export เข้าคิว คืน job (dict)
+    ถ้ามีงานชนิดเดียวกัน พารามิเตอร์เดียวกัน ยังไม่จบ → ใช้งานเดิม ไม่สร้างซ้ำ
+    """
+    build, names = EXPORTERS[kind]
+    params = {n: values.get(n, "") for n in names}
+    key = json.dumps([kind, params], sort_keys=True, ensure_ascii=False)
+
+    with _export_jobs_lock:
+        _prune_export_jobs()
+
+        job_id = _export_inflight.get(key)
+        if job_id:
+            return _export_jobs[job_id]
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "key": key,
+            "status": "queued",
+            "progress": 0,
+            "error": None,
+            "path": None,
+            "filename": None,
+            "finished_at": None,
+        }
+        _export_jobs[job["id"]] = job
+        _export_inflight[key] = job["id"]
+
+    _export_pool.submit(_run_export_job, job, build, MultiDict(params))
+    return job
+
+
+def _run_export_job(job, build, args):
+    def progress(done, total):
+        if total:
+            job["progress"] = min(99, done * 100 // total)
+
+    job["status"] = "running"
+    try:
+        # get_db() / registry ใช้ g → ต้องมี app context ใน thread นี้
+        with app.app_context():
+            path, filename = build(args, progress)
+    except ExportError as e:
+        job.update(status="error", error=str(e))
+    except Exception:
+        app.logger.exception("export job %s ล้มเหลว", job["id"])
+        job.update(status="error", error="สร้างไฟล์ไม่สำเร็จ")
+    else:
+        job.update(status="done", progress=100, path=path, filename=filename)
+    finally:
+        with _export_jobs_lock:
+            job["finished_at"] = time.time()
+            _export_inflight.pop(job["key"], None)
+
+
+def _prune_export_jobs():
+    # เรียกตอนถือ _export_jobs_lock อยู่แล้ว
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _export_jobs.items()
+        if job["finished_at"] and now - job["finished_at"] > EXPORT_JOB_KEEP
+    ]
+    for job_id in expired:
+        del _export_jobs[job_id]
+
+
+def export_job_status(job):
+    data = {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "params": job["params"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "status_url": url_for("export_job", job_id=job["id"]),
+    }
+    if job["status"] == "done":
+        data["download_url"] = url_for("export_job_download", job_id=job["id"])
+    if job["error"]:
+        data["error"] = job["error"]
+    return data
+
+
+@app.route("/export-jobs/<kind>", methods=["POST"])
+def export_job_submit(kind):
+    if kind not in EXPORTERS:
+        return jsonify(error="ไม่รู้จักชนิด export นี้"), 404
+
+    job = submit_export_job(kind, request.values)
+    return jsonify(export_job_status(job)), 202
+
+
+@app.route("/export-jobs/<job_id>")
+def export_job(job_id):
+    job = _export_jobs.get(job_id)
+    if not job:
+        return jsonify(error="ไม่พบงาน export นี้"), 404
+    return jsonify(export_job_status(job))
+
+
+@app.route("/export-jobs/<job_id>/download")
+def export_job_download(job_id):
+    job = _export_jobs.get(job_id)
+    if not job:
+        return "ไม่พบงาน export นี้", 404
+    if job["status"] != "done":
+        return "ไฟล์ยังไม่พร้อม", 409
+    if not os.path.exists(job["path"]):
+        # ถูกล้างออกจาก reports/cache/ ไปแล้ว
+        return "ไฟล์หมดอายุแล้ว กรุณาสั่ง export ใหม่", 410
+    return send_export(job["path"], job["filename"])
+
+
 # ==================================================
 # RUN
 # ==================================================
 if __name__ == "__main__":
-    init_db()              # สร้าง/เช็กตารางเดิม
-    init_assets_db()       # สร้าง/เช็กตารางครุภัณฑ์
-    fix_signature_column() # แก้โครงสร้างคอลัมน์เก่า
+    open_db().close()      # สร้าง/อัปเกรดตาราง (ถ้ายังไม่ล่าสุด)
     app.run(host="0.0.0.0", debug=True)
 
 
@@ -0,0 +1,50 @@
+"""
+นำเข้างานย้อนหลังจากไฟล์ Excel รูปแบบเดียวกับ export_excel (รายงานแจ้งปัญหา)
+
+    python scripts/backfill_reports.py                         # ทุกไฟล์ .xlsx ใน history/
+    python scripts/backfill_reports.py เก่า/2566/*.xlsx งาน.xlsx
+
+งานที่มีอยู่แล้ว (เลขงานเดียวกัน ถ้าไฟล์มีคอลัมน์เลขงาน /
+นาทีเดียวกัน + หน่วยงาน + ผู้แจ้ง + ปัญหา) จะข้าม → รันซ้ำได้
+"""
+import glob
+import os
+import sys
+import time
+
+# ให้ import app.py จากโฟลเดอร์หลักได้
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, get_db, backfill_report_files, backfill_sources
+
+
+def main(patterns):
+    if patterns:
+        paths = sorted({p for pattern in patterns for p in glob.glob(pattern)})
+    else:
+        paths = backfill_sources()
+    if not paths:
+        print("ไม่พบไฟล์ที่จะนำเข้า")
+        return 1
+
+    started = time.perf_counter()
+    with app.app_context():
+        files = backfill_report_files(get_db(), [(p, p) for p in paths])
+
+    for f in files:
+        if f["error"]:
+            print(f"❌ {f['name']}: {f['error']}")
+            continue
+        print(f"✅ {f['name']}: เพิ่ม {f['inserted']} / ซ้ำ {f['duplicates']} / ข้าม {len(f['skipped'])}")
+        for row_no, value, message in f["skipped"]:
+            print(f"     แถว {row_no}: {message} ({value})")
+
+    inserted = sum(f["inserted"] for f in files)
+    elapsed = time.perf_counter() - started
+    print(f"\nนำเข้าเรียบร้อย {inserted} งาน จาก {len(files)} ไฟล์ ({elapsed:.1f} วินาที)")
+    return 1 if all(f["error"] for f in files) else 0
+
+
+# process pool แบบ spawn import ไฟล์นี้ซ้ำในทุก process ลูก → ต้องอยู่ใต้ __main__
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
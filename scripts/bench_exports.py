@@ -0,0 +1,274 @@
+"""
+วัดความเร็ว export ทั้ง 5 แบบ ที่ขนาดข้อมูล 1k / 10k / 100k แถว
+
+    python scripts/bench_exports.py                    # วัดแล้วเทียบกับ baseline
+    python scripts/bench_exports.py --sizes 1000 10000
+    python scripts/bench_exports.py --save-baseline    # บันทึกผลเป็น baseline ใหม่
+
+แต่ละขนาดรันใน process แยก + ฐานข้อมูลชั่วคราว (ไม่แตะ report.db จริง)
+เวลา = รอบที่ไม่เปิด tracemalloc / หน่วยความจำ = อีกรอบที่เปิด tracemalloc
+ช้าลง / ใช้หน่วยความจำเพิ่ม / ไฟล์ใหญ่ขึ้นเกิน --tolerance → exit 1
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "scripts", "bench_baseline.json")
+
+SIZES = [1000, 10000, 100000]
+BENCH_STAFF = "เจ้าหน้าที่ 0000"
+
+JOB_TYPES = ["Software", "Hardware", "Network", "Other"]
+ASSET_TYPES = ["Computer", "Notebook", "Printer", "Scanner", "Tablet", "UPS", "Display"]
+ASSET_STATUS = ["ใช้งาน", "ยังไม่ได้ตรวจสอบ", "ชำรุด"]
+CONFIRM_NAMES = ["นนท์ณพัฒน์ กันตพลอิทธิ", "ชัยวุฒิ ศรีแก้ว", "ว่าทีร้อยตรี ณรงค์ศักดิ์ สุทธาแสง"]
+
+
+def export_urls(year):
+    return {
+        "export_excel": f"/export-excel?date_from={year}-01-01&date_to={year}-12-31",
+        "export_attendance_excel": f"/attendance/export?staff_name={BENCH_STAFF}&month=1",
+        "export_assets_excel": "/assets/export-excel",
+        "export_assets_summary": "/assets/export-summary",
+        "export_report_monthly_summary": f"/report-monthly-summary/export?month=1&year={year}",
+    }
+
+
+# ==================================================
+# process ลูก: สร้างฐานข้อมูลขนาด n แล้ววัดทุก export
+# ==================================================
+def seed(app, n, year):
+    depts = list(app.DEPT_FULLNAME)
+    start = datetime(year, 1, 1, 8, 0, 0)
+    minutes = 365 * 24 * 60
+
+    conn = app.get_db()
+    with app.write_tx(conn):
+        conn.executemany(
+            """
+            INSERT INTO reports (
+                work_no, receive_datetime, department, reporter, job_type,
+                asset_no, problem, solution, confirm_name, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    f"B{i:07d}",
+                    (start + timedelta(minutes=i * minutes // n)).strftime(app.TS_FORMAT),
+                    depts[i % len(depts)],
+                    f"ผู้แจ้ง {i % 50}",
+                    JOB_TYPES[i % len(JOB_TYPES)],
+                    f"7440-001-{i % 9999:04d}",
+                    f"เครื่องคอมพิวเตอร์เปิดไม่ติด ครั้งที่ {i}",
+                    "ตรวจสอบสายไฟและเปลี่ยนอุปกรณ์จ่ายไฟ",
+                    CONFIRM_NAMES[i % len(CONFIRM_NAMES)],
+                    start.strftime(app.TS_FORMAT),
+                )
+                for i in range(n)
+            ),
+        )
+
+        conn.executemany(
+            """
+            INSERT INTO assets (
+                asset_no, asset_type, asset_model, serial_no, hostname,
+                owner_name, position, department, status
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    f"7440-001-{i:06d}-ค{i % 1000:03d}/{60 + i % 7}",
+                    ASSET_TYPES[i % len(ASSET_TYPES)],
+                    f"รุ่น {i % 40}",
+                    f"SN{i:08d}",
+                    f"PC-{i:06d}",
+                    f"ผู้ใช้ {i % 500}",
+                    "นักวิชาการคอมพิวเตอร์",
+                    depts[i % len(depts)],
+                    ASSET_STATUS[i % len(ASSET_STATUS)],
+                )
+                for i in range(n)
+            ),
+        )
+
+        # คนละ 365 วัน → คนแรก (BENCH_STAFF) มีครบทุกวันของเดือน 1
+        conn.executemany(
+            """
+            INSERT INTO attendance (staff_name, work_date, time_in, time_out)
+            VALUES (?, ?, ?, ?)
+            """,
+            (
+                (
+                    f"เจ้าหน้าที่ {i // 365:04d}",
+                    (start + timedelta(days=i % 365)).strftime("%Y-%m-%d"),
+                    "08:30",
+                    "16:30",
+                )
+                for i in range(n)
+            ),
+        )
+
+
+def measure(client, url, memory):
+    # ล้าง cache ทุกครั้ง → วัดการสร้างไฟล์จริง ไม่ใช่การส่งไฟล์เดิม
+    shutil.rmtree("reports", ignore_errors=True)
+
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(url)
+    data = response.get_data()
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} → {response.status_code}")
+    return elapsed, peak, len(data)
+
+
+def run_size(n):
+    workdir = tempfile.mkdtemp(prefix="bench_exports_")
+    try:
+        # app ใช้ path แบบ relative (report.db / reports/ / static/...)
+        # → ย้ายไปทำงานในโฟลเดอร์ชั่วคราว ฐานข้อมูลจริงไม่ถูกแตะ
+        os.makedirs(os.path.join(workdir, "static", "img"))
+        os.makedirs(os.path.join(workdir, "static", "signatures"))
+        logo = os.path.join(ROOT, "static", "img", "logo.png")
+        shutil.copy(logo, os.path.join(workdir, "static", "img", "logo.png"))
+        shutil.copy(logo, os.path.join(workdir, "static", "signatures", f"{BENCH_STAFF}.png"))
+        os.chdir(workdir)
+
+        sys.path.insert(0, ROOT)
+        import app as report_app
+
+        year = datetime.now().year
+        with report_app.app.app_context():
+            seed(report_app, n, year)
+
+        client = report_app.app.test_client()
+        results = {}
+        for name, url in export_urls(year).items():
+            elapsed, _, size = measure(client, url, memory=False)
+            _, peak, _ = measure(client, url, memory=True)
+            results[name] = {
+                "seconds": round(elapsed, 3),
+                "peak_mb": round(peak / 1024 / 1024, 2),
+                "bytes": size,
+            }
+        return results
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ==================================================
+# process หลัก: รันทีละขนาด / เทียบ baseline
+# ==================================================
+def environment():
+    import openpyxl
+    from openpyxl.xml import LXML
+
+    return {
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "openpyxl": openpyxl.__version__,
+        "lxml": LXML,
+    }
+
+
+def compare(value, base, tolerance):
+    if not base:
+        return "", False
+    ratio = value / base
+    return f"x{ratio:.2f}", ratio > 1 + tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark export Excel")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="ยอมให้แย่ลงได้กี่เท่า (0.25 = 25%%)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_size(args.worker)))
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+
+    print(f"{'export':32} {'rows':>7} {'time(s)':>9} {'':>6} {'peak(MB)':>9} {'':>6} {'size(KB)':>9} {'':>6}")
+    for n in args.sizes:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(n)],
+            capture_output=True, text=True, cwd=ROOT,
+        )
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            return 2
+
+        results[str(n)] = json.loads(proc.stdout.strip().splitlines()[-1])
+        base_size = baseline.get("results", {}).get(str(n), {})
+
+        for name, r in results[str(n)].items():
+            base = base_size.get(name, {})
+            cells = []
+            for key in ("seconds", "peak_mb", "bytes"):
+                label, worse = compare(r[key], base.get(key), args.tolerance)
+                cells.append(label)
+                if worse:
+                    regressions.append(f"{name} @ {n} rows: {key} {base[key]} → {r[key]}")
+
+            print(
+                f"{name:32} {n:>7} {r['seconds']:>9.3f} {cells[0]:>6} "
+                f"{r['peak_mb']:>9.2f} {cells[1]:>6} {r['bytes'] / 1024:>9.1f} {cells[2]:>6}"
+            )
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {"environment": environment(), "results": results},
+                f, ensure_ascii=False, indent=2,
+            )
+        print(f"\nบันทึก baseline แล้ว → {os.path.relpath(args.baseline, ROOT)}")
+        return 0
+
+    if not baseline:
+        print("\nยังไม่มี baseline (รันด้วย --save-baseline เพื่อบันทึก)")
+        return 0
+
+    env = baseline.get("environment", {})
+    print(f"\nเทียบกับ baseline วันที่ {env.get('date')} (openpyxl {env.get('openpyxl')}, lxml={env.get('lxml')})")
+    if regressions:
+        print("⚠️ ช้าลง / ใหญ่ขึ้นเกินเกณฑ์:")
+        for line in regressions:
+            print("  -", line)
+        return 1
+
+    print("✅ ไม่มี export ไหนแย่ลงเกินเกณฑ์")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# ให้ import app.py จากโฟลเดอร์หลักได้
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import open_db, write_tx, rebuild_report_rollup
+
+# ใช้หลังนำเข้างานย้อนหลัง หรือแก้ข้อมูลใน reports ตรง ๆ โดยไม่ผ่านเว็บ
+conn = open_db()
+with write_tx(conn):
+    rebuild_report_rollup(conn)
+    rows = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(total), 0) FROM report_monthly_rollup"
+    ).fetchone()
+conn.close()
+
+print(f"สร้างตารางสรุปรายเดือนใหม่เรียบร้อย {rows[0]} แถว / {rows[1]} งาน")
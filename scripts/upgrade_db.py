@@ -1,15 +1,18 @@
+import os
 import sqlite3
+import sys
 
-conn = sqlite3.connect("report.db")
-cursor = conn.cursor()
+# ให้ import app.py จากโฟลเดอร์หลักได้
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# เพิ่มคอลัมน์เลขงาน
-cursor.execute("ALTER TABLE reports ADD COLUMN work_no TEXT")
+from app import DB_NAME, migrate_db, SCHEMA_VERSION
 
-# บังคับไม่ให้เลขงานซ้ำ
-cursor.execute("CREATE UNIQUE INDEX idx_work_no ON reports(work_no)")
-
-conn.commit()
+# รันซ้ำได้ ถ้าล่าสุดแล้วจะไม่ทำอะไร
+conn = sqlite3.connect(DB_NAME)
+before, after = migrate_db(conn)
 conn.close()
 
-print("อัปเกรดฐานข้อมูลเรียบร้อย")
+if before == after:
+    print(f"ฐานข้อมูลเป็นเวอร์ชันล่าสุดแล้ว (v{SCHEMA_VERSION})")
+else:
+    print(f"อัปเกรดฐานข้อมูลเรียบร้อย v{before} → v{after}")